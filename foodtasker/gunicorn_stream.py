@@ -0,0 +1,14 @@
+# gunicorn settings of the "stream" process serving the restaurant order
+# streams, see Procfile. Waiting clients cost a greenlet instead of a thread.
+import os
+
+bind = '0.0.0.0:%s' % os.environ.get('STREAM_PORT', '8001')
+worker_class = 'gevent'
+worker_connections = 1000
+raw_env = ['NOTIFICATION_STREAM_MAX_CLIENTS=%d' % worker_connections]
+
+
+def post_fork(server, worker):
+    # let psycopg2 yield to the other greenlets while it waits on the database
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
@@ -46,6 +46,9 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # static files are answered here, before any other work
+    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'foodtaskerapp.profiling.ProfilingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -127,15 +130,35 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+# collectstatic writes content hashed names with gzip and brotli copies,
+# served by whitenoise with far-future cache headers
+STATICFILES_STORAGE = 'foodtaskerapp.files.StaticFilesStorage'
 
 LOGIN_REDIRECT_URL = '/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
+# Media is served by foodtaskerapp.files when DEBUG is off. Cache lifetime
+# of uploads, renditions are cached for a year. With MEDIA_ACCEL_REDIRECT
+# set, e.g. to an nginx internal location aliased to MEDIA_ROOT, the web
+# server sends the files instead of gunicorn.
+MEDIA_MAX_AGE = 60 * 60
+MEDIA_ACCEL_REDIRECT = os.environ.get('MEDIA_ACCEL_REDIRECT')
+
+# Connections are kept open between requests for DATABASE_CONN_MAX_AGE
+# seconds, 0 opens one per request. Each gunicorn thread keeps its own, at
+# most DATABASE_POOL_SIZE per process stay open after a request, so the
+# database sees up to workers * DATABASE_POOL_SIZE of them. A connection idle
+# for DATABASE_HEALTH_CHECK_AFTER seconds is tested before it is reused, see
+# foodtaskerapp.dbpool.
+DATABASE_CONN_MAX_AGE = int(os.environ.get('DATABASE_CONN_MAX_AGE', 300))
+DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE', 16))
+DATABASE_HEALTH_CHECK_AFTER = 30
 
 import dj_database_url
-db_from_env = dj_database_url.config()
+db_from_env = dj_database_url.config(conn_max_age=DATABASE_CONN_MAX_AGE)
 DATABASES['default'].update(db_from_env)
+DATABASES['default']['CONN_MAX_AGE'] = DATABASE_CONN_MAX_AGE
 
 
 AUTHENTICATION_BACKENDS = (
@@ -170,3 +193,70 @@ SOCIAL_AUTH_PIPELINE = (
 )
 
 STRIPE_API_KEY = 'sk_test_CIlQLWqJmuSmDFQoQwvDYZAp'
+
+# Orders are charged in the background, see foodtaskerapp.payments.
+# Use 'foodtaskerapp.payments.StubGateway' to run without Stripe.
+PAYMENT_GATEWAY = 'foodtaskerapp.payments.StripeGateway'
+PAYMENT_MAX_RETRIES = 3
+# Orders still waiting for their payment this many seconds after they were
+# placed lost their background job, e.g. to a deploy. The dispatch process
+# charges them once more every PAYMENT_SWEEP_INTERVAL seconds.
+PAYMENT_SWEEP_AFTER = 600
+PAYMENT_SWEEP_INTERVAL = 60
+
+# Thread pool sizes of the in-process background workers, per pool
+BACKGROUND_WORKERS = {
+    'payments': 4,
+    'images': 2,
+}
+
+# Restaurant order streams send a keepalive after this many quiet seconds,
+# and end after NOTIFICATION_STREAM_MAX_AGE so browsers reconnect.
+NOTIFICATION_STREAM_HEARTBEAT = 15
+NOTIFICATION_STREAM_MAX_AGE = 300
+# Each process serving streams reads the new notifications of all its
+# clients with one query this often.
+NOTIFICATION_POLL_INTERVAL = 1
+# Notifications are kept this long for reconnecting streams to replay, the
+# dispatch process deletes older ones every PAYMENT_SWEEP_INTERVAL.
+NOTIFICATION_RETENTION = 600
+# Every open stream keeps a thread busy: the gthread web processes serve a
+# few, the gevent "stream" process (see Procfile) many more. The front web
+# server routes /api/restaurant/order/stream/ to the stream process.
+NOTIFICATION_STREAM_MAX_CLIENTS = int(os.environ.get('NOTIFICATION_STREAM_MAX_CLIENTS', 4))
+
+# Driver positions are kept in memory and written every few seconds, pings
+# during a delivery are also kept as the order's track.
+LOCATION_FLUSH_INTERVAL = 5
+LOCATION_TRACK_DELIVERIES = True
+
+# Default and largest page sizes of the paginated list endpoints. Lists are
+# only paginated for clients passing cursor or page_size.
+PAGINATION_PAGE_SIZE = 20
+PAGINATION_MAX_PAGE_SIZE = 100
+
+# The dispatch engine (manage.py run_dispatch) offers READY orders to the
+# drivers who reported their position in the last DISPATCH_DRIVER_TIMEOUT
+# seconds, every DISPATCH_INTERVAL seconds
+DISPATCH_INTERVAL = 10
+DISPATCH_DRIVER_TIMEOUT = 120
+
+# Request metrics are served at /metrics/ for Prometheus, behind the
+# METRICS_TOKEN bearer token, and answer 404 when it is not set.
+# PROFILING_SAMPLE_RATE of the requests run under cProfile, the slow ones
+# are dumped to PROFILING_DIR.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0))
+PROFILING_SLOW_REQUEST = 1
+PROFILING_DIR = os.path.join(BASE_DIR, 'profiles')
+
+# Number of restaurant menu snapshots kept per process
+MENU_CACHE_SIZE = 500
+
+# Access tokens resolved to customer/driver profiles are cached per process.
+# Entries never outlive the token itself. A revoked token is dropped at once
+# by the process revoking it, and within TOKEN_REVOCATION_CHECK_INTERVAL
+# seconds by the others, which read the RevokedToken rows written since.
+TOKEN_CACHE_TTL = 60
+TOKEN_CACHE_SIZE = 10000
+TOKEN_REVOCATION_CHECK_INTERVAL = 2
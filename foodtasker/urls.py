@@ -22,6 +22,7 @@ urlpatterns = [
     url(r'^restaurant/meal/add/$', views.restaurant_add_meal, name = 'restaurant-add-meal'),
     url(r'^restaurant/meal/edit/(?P<meal_id>\d+)/$', views.restaurant_edit_meal, name = 'restaurant-edit-meal'),
     url(r'^restaurant/order/$', views.restaurant_order, name = 'restaurant-order'),
+    url(r'^restaurant/order/changes/$', views.restaurant_order_changes, name = 'restaurant-order-changes'),
     url(r'^restaurant/category/$', views.restaurant_categories, name='restaurant-categories'),
     url(r'^restaurant/category/edit/(?P<category_id>\d+)/$', views.restaurant_edit_category, name='restaurant-edit-category'),
     url(r'^restaurant/category/add/$', views.restaurant_add_category, name='restaurant-add-category'),
@@ -38,20 +39,34 @@ urlpatterns = [
     url(r'^api/customer/restaurants/$', apis.customer_get_restaurants),
     url(r'^api/customer/nearby-restaurants/$', apis.get_open_restaurants_near_customer),
     url(r'^api/customer/meals/(?P<restaurant_id>\d+)/$', apis.customer_get_meals),
+    url(r'^api/customer/menu/(?P<restaurant_id>\d+)/$', apis.customer_get_menu),
     url(r'^api/customer/order/add/$', apis.customer_add_order),
     url(r'^api/customer/order/latest/$', apis.customer_get_latest_order),
     url(r'^api/restaurant/order/notification/(?P<last_request_time>.+)/$', apis.restaurant_order_notification),
+    url(r'^api/restaurant/order/stream/$', apis.restaurant_order_stream),
     url(r'^api/customer/driver/location/$', apis.customer_driver_location),
     url(r'^api/meal-extras/(?P<restaurant_id>\d+)/$', apis.get_meal_modifiers),
 
     # APIs for DRIVERS
     url(r'^api/driver/orders/ready/$', apis.driver_get_ready_orders),
     url(r'^api/driver/order/pick/$', apis.driver_pick_order),
+    url(r'^api/driver/order/claim-next/$', apis.driver_claim_next_order),
+    url(r'^api/driver/order/offer/$', apis.driver_get_offer),
     url(r'^api/driver/order/latest/$', apis.driver_get_latest_order),
     url(r'^api/driver/order/complete/$', apis.driver_complete_order),
     url(r'^api/driver/revenue/$', apis.driver_get_revenue),
     url(r'^api/driver/location/update/$', apis.driver_update_location),
     url(r'^api/driver/order/get-ready-order/$', apis.get_oldest_order),
 
+    # Prometheus metrics of the requests served
+    url(r'^metrics/$', apis.metrics),
 
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+
+]
+
+if settings.DEBUG:
+    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+else:
+    urlpatterns += [
+        url(r'^%s(?P<path>.+)$' % settings.MEDIA_URL.lstrip('/'), views.media),
+    ]
@@ -15,6 +15,4 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "foodtasker.settings")
 
 application = get_wsgi_application()
 
-# Use whitenoise package to serve static files on heroku
-from whitenoise.django import DjangoWhiteNoise
-application = DjangoWhiteNoise(application)
+# Static files are served by whitenoise.middleware.WhiteNoiseMiddleware
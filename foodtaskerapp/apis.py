@@ -1,38 +1,31 @@
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 import json
-import logging
+from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import csrf_exempt
+from django.db import transaction
 
-from oauth2_provider.models import AccessToken
-from django.utils import timezone
-from foodtaskerapp.models import Restaurant, Meal, Order, OrderDetails, Driver, Modifier
-from foodtaskerapp.serializers import RestaurantSerializer, MealSerializer, OrderSerializer
-from collections import defaultdict
+from django.utils.dateparse import parse_datetime
+from foodtaskerapp.models import Restaurant, Meal, Order, OrderDetails
+from foodtaskerapp.serializers import RestaurantSerializer, OrderSerializer, ORDER_VALUES, fast_orders
+from foodtaskerapp.encoding import FastJsonResponse
+from foodtaskerapp.pagination import CursorPagination, InvalidCursor, is_paginated
+from foodtaskerapp import catalog, dispatch, geo, lifecycle, locations, notifications, payments, profiling, reports, tokens
 
 
-import stripe
-from foodtasker.settings import STRIPE_API_KEY
-
-stripe.api_key = STRIPE_API_KEY
-
 def customer_get_restaurants(request):
-    restaurants = RestaurantSerializer(
-        Restaurant.objects.all().order_by("-id"),
-        many = True,
-        context = {"request": request}
-    ).data
-
-    return JsonResponse({"restaurants": restaurants})
+    # Pre-rendered, answers 304 when the app already has the current catalog
+    return catalog.restaurants_response(request)
 
 
 def customer_get_meals(request, restaurant_id):
-    meals = MealSerializer(
-    Meal.objects.filter(restaurant_id = restaurant_id).order_by("-id"),
-    many = True,
-    context = {"request": request}
-    ).data
+    return catalog.meals_response(request, restaurant_id)
 
-    return JsonResponse({"meals": meals})
+
+def customer_get_menu(request, restaurant_id):
+    '''
+    Meals, categories and modifier groups of a restaurant in one document
+    '''
+    return catalog.menu_response(request, restaurant_id)
 
 @csrf_exempt
 def customer_add_order(request):
@@ -45,12 +38,8 @@ def customer_add_order(request):
             phone_no
     """
     if request.method == "POST":
-        # Get Token
-        access_token = AccessToken.objects.get(token = request.POST.get("access_token"), expires__gt = timezone.now())
-
         # Get Profile from token
-
-        customer = access_token.user.customer
+        customer = tokens.get_customer(request.POST.get("access_token"))
 
         # GET STRIPE token
         stripe_token = request.POST["stripe_token"]
@@ -61,7 +50,7 @@ def customer_add_order(request):
 
         # Check whether customer has any order that is not delivered
 
-        if Order.objects.filter(customer = customer).exclude(status = Order.DELIVERED):
+        if lifecycle.has_active_order(customer):
             return JsonResponse({"status": "fail", "error": "Your Last Order must be completed."})
 
 
@@ -73,90 +62,109 @@ def customer_add_order(request):
         # Get Order Details
         order_details = json.loads(request.POST["order_details"])
 
-        order_total = 0
+        # Prices of every meal in the order in a single query
+        meal_ids = [int(meal["meal_id"]) for meal in order_details]
+        meals = Meal.objects.in_bulk(meal_ids)
+        if len(meals) != len(set(meal_ids)):
+            return JsonResponse({"status": "failed", "error": "Meal is no longer available"})
+
+        sub_totals = [meals[meal_id].price * meal["quantity"] for meal_id, meal in zip(meal_ids, order_details)]
+        order_converted_total = int(sum(sub_totals)) # Convert Price to Int and Send to Stripe
+
         shipping_total = 5
-        order_final_payment_price = 0
-        for meal in order_details:
-            order_total += Meal.objects.get(id = meal["meal_id"]).price * meal["quantity"]
-            order_converted_total = int(order_total) # Convert Price to Int and Send to Stripe
-            
-            if order_converted_total < 50:
-                shipping_total = 5
-                order_final_payment_price = int(order_converted_total + shipping_total)
-                logging.error(order_final_payment_price)
-                
-                
-            if order_converted_total > 50:
-                shipping_total = 0
-                order_final_payment_price = int(order_converted_total + shipping_total)
-                logging.error(order_final_payment_price)
+        if order_converted_total > 50:
+            shipping_total = 0
+        order_final_payment_price = int(order_converted_total + shipping_total)
 
         if len(order_details) > 0:
+            with transaction.atomic():
+                # Another request of the same customer may have placed an order meanwhile
+                if lifecycle.active_order_id(customer, lock = True) is not None:
+                    return JsonResponse({"status": "fail", "error": "Your Last Order must be completed."})
 
-            # Step 1: Create a charge: This will Charge Customers Card
-            charge = stripe.Charge.create(
-                amount = order_final_payment_price * 100, # Amount in Cents
-                currency = "aud",
-                source = stripe_token,
-                description = "B!te Order"
-            )
-
-            if charge.status != "failed":
-                # Step two - Create Order
+                # Step 1: Create Order, it waits for the payment before the restaurant sees it
                 order = Order.objects.create(
                 customer = customer,
                 restaurant_id = request.POST["restaurant_id"],
                 total = order_final_payment_price,
-                status = Order.PREPARING,
-                address = request.POST["address"]
-                extra_notes = request.POST["extra_notes"]
+                status = Order.PENDING_PAYMENT,
+                address = request.POST["address"],
+                extra_notes = request.POST["extra_notes"],
+                payment_source = stripe_token
                 )
 
                 #step two - Create Order Details
-
-                for meal in order_details:
-                    OrderDetails.objects.create(
+                OrderDetails.objects.bulk_create([
+                    OrderDetails(
                         order = order,
                         meal_id = meal["meal_id"],
                         quantity = meal["quantity"],
-                        sub_total = Meal.objects.get(id = meal["meal_id"]).price * meal["quantity"]
-
+                        sub_total = sub_total
                     )
+                    for meal, sub_total in zip(order_details, sub_totals)
+                ])
 
-                return JsonResponse({"status": "success"})
+                # Step 3: Charge the Customers Card in the background
+                payments.enqueue_charge(order)
 
-            else:
-                return JsonResponse({"status": "failed", "error": "Failed to Connect to Payment Gateway"})
+            return JsonResponse({"status": "success", "order_id": order.id})
 
 
 
 
 def customer_get_latest_order(request):
-    access_token = AccessToken.objects.get(token = request.GET.get("access_token"), expires__gt = timezone.now())
-
-    customer = access_token.user.customer
-    order = OrderSerializer(Order.objects.filter(customer = customer).last()).data
+    customer = tokens.get_customer(request.GET.get("access_token"))
+    order = OrderSerializer(Order.objects.with_details().filter(customer = customer).last()).data
 
     return JsonResponse({"order": order})
 
 
 def restaurant_order_notification(request, last_request_time):
     notification = Order.objects.filter(restaurant = request.user.restaurant,
-    created_at__gt = last_request_time).count()
+    created_at__gt = last_request_time).exclude(status__in = [Order.PENDING_PAYMENT, Order.PAYMENT_FAILED]).count()
 
     return JsonResponse({"notification": notification})
 
 
-def customer_driver_location(request):
-    access_token = AccessToken.objects.get(token = request.GET.get("access_token"), expires__gt = timezone.now())
+@login_required(login_url='/restaurant/sign-in/')
+def restaurant_order_stream(request):
+    '''
+    Server-sent events for new orders and order status changes of the
+    signed in restaurant. Browsers send Last-Event-ID when reconnecting,
+    and receive whatever they missed from the notification backlog.
+    '''
+    user = request.user.restaurant.user
+    since = parse_datetime(request.META.get("HTTP_LAST_EVENT_ID", ""))
 
-    customer = access_token.user.customer
+    events = notifications.open_stream(user, since)
+    if events is None:
+        # browsers do not reconnect after a 204, the page polls instead
+        return HttpResponse(status = 204)
+
+    response = StreamingHttpResponse(events, content_type = "text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def customer_driver_location(request):
+    customer = tokens.get_customer(request.GET.get("access_token"))
 
     # Get Driver Assigned to Job's location
-    current_order = Order.objects.filter(customer = customer, status = Order.ONTHEWAY).last()
-    location = current_order.driver.location
+    driver_id = Order.objects.filter(id = lifecycle.active_order_id(customer), status = Order.ONTHEWAY)\
+                    .values_list("driver_id", flat = True).first()
+    if driver_id is None:
+        return JsonResponse({"status": "failed", "error": "No order is on the way"})
 
-    return JsonResponse({"location": location})
+    position = locations.store.current(driver_id)
+    if position is None:
+        return JsonResponse({"status": "failed", "error": "The driver has not shared a location yet"})
+
+    return JsonResponse({
+        "location": position.location,
+        "latitude": position.latitude,
+        "longitude": position.longitude
+    })
 
 
 
@@ -170,7 +178,8 @@ def driver_get_ready_orders(request):
     Get orders which are ready to be picked. Restaurant should be within 5km
     of the driver's location
     :param request: Django request object
-    :return: List of orders which are ready
+    :return: List of orders which are ready, one page of it when the
+             client asks for pages with cursor or page_size
     '''
     latitude = request.GET.get('latitude')
     longitude = request.GET.get('longitude')
@@ -184,85 +193,97 @@ def driver_get_ready_orders(request):
     latitude = float(latitude)
     longitude = float(longitude)
 
-    restaurants = Restaurant.objects.all()
-    nearby_restaurants = [restaurant for restaurant in restaurants if restaurant.get_distance(latitude, longitude) <= 5]
+    nearby_restaurants = [restaurant for restaurant, distance in geo.restaurants_within(latitude, longitude, 5)]
+
+    # plain rows, serialized without model instances
+    rows = Order.objects.filter(status=Order.READY, driver=None, restaurant__in=nearby_restaurants).values(*ORDER_VALUES)
+    if not is_paginated(request):
+        return FastJsonResponse({"orders": fast_orders(rows.order_by("-id"))})
 
-    orders = OrderSerializer(
-        Order.objects.filter(status=Order.READY, driver=None, restaurant__in=nearby_restaurants).order_by("-id"),
-        many=True).data
-    return JsonResponse({"orders": orders})
+    try:
+        pagination = CursorPagination(request, ordering="-id")
+    except InvalidCursor as error:
+        return JsonResponse({'status': 'failed', 'error': str(error)})
+    rows, next_cursor = pagination.paginate(rows, key=lambda row: row["id"])
+    return FastJsonResponse({"orders": fast_orders(rows), "next_cursor": next_cursor})
 
 @csrf_exempt
 def driver_pick_order(request):
     if request.method == "POST":
-        access_token = AccessToken.objects.get(token = request.POST.get("access_token"), expires__gt = timezone.now())
+        driver = tokens.get_driver(request.POST.get("access_token"))
 
-        driver = access_token.user.driver
+        # Claim the order, unless another driver was faster or this driver
+        # is still delivering an order
+        if dispatch.claim_order(request.POST["order_id"], driver):
+            return JsonResponse({"status": "success"})
 
-        # Check if Available for Driver Selection
-        if Order.objects.filter(driver = driver).exclude(status = Order.ONTHEWAY):
+        if lifecycle.has_active_order(driver):
             return JsonResponse({"status": "failed", "error": "Only One Order can be selected at the same time"})
+        return JsonResponse({"status": "failed", "error": "This order has been picked up by another driver"})
 
-        try:
-            order = Order.objects.get(
-            id = request.POST["order_id"],
-            driver = None,
-            status = Order.READY
-            )
+@csrf_exempt
+def driver_claim_next_order(request):
+    '''
+    Claim the best ready order near the driver in one call, skipping the
+    orders other drivers are taking at the same time
+    params:
+        access_token
+        latitude
+        longitude
+    '''
+    if request.method == "POST":
+        driver = tokens.get_driver(request.POST.get("access_token"))
 
+        latitude = request.POST.get('latitude')
+        longitude = request.POST.get('longitude')
+        if not (latitude and longitude):
+            return JsonResponse({"status": "failed", "error": "Driver co-ordinates required"})
 
-            order.driver = driver
-            order.status = Order.ONTHEWAY
-            order.picked_at = timezone.now()
-            order.save()
+        if lifecycle.has_active_order(driver):
+            return JsonResponse({"status": "failed", "error": "Only One Order can be selected at the same time"})
 
-            return JsonResponse({"status": "success"})
+        order = dispatch.claim_next_order(driver, float(latitude), float(longitude))
+        if order is None:
+            return JsonResponse({"status": "failed", "error": "No orders are ready in your vicinity"})
+        return JsonResponse({"status": "success", "order": OrderSerializer(order).data})
 
-        except Order.DoesNotExist:
-            return JsonResponse({"status": "failed", "error": "This order has been picked up by another driver"})
+def driver_get_offer(request):
+    '''
+    The ready order the dispatch engine picked for this driver, to be
+    claimed with driver_pick_order
+    '''
+    driver = tokens.get_driver(request.GET.get("access_token"))
 
-def driver_get_latest_order(request):
-    access_token = AccessToken.objects.get(token = request.GET.get("access_token"), expires__gt = timezone.now())
+    order = dispatch.current_offer(driver)
+    if order is None:
+        return JsonResponse({"status": "success", "message": "No orders are ready in your vicinity"})
+    return JsonResponse({"status": "success", "order": OrderSerializer(order).data})
 
-    driver = access_token.user.driver
+def driver_get_latest_order(request):
+    driver = tokens.get_driver(request.GET.get("access_token"))
     order = OrderSerializer(
-    Order.objects.filter(driver = driver).order_by("picked_at").last()
+    Order.objects.with_details().filter(driver = driver).order_by("picked_at").last()
     ).data
 
     return JsonResponse({"order": order})
 
 @csrf_exempt
 def driver_complete_order(request):
-    access_token = AccessToken.objects.get(token = request.POST.get("access_token"), expires__gt = timezone.now())
-
-    driver = access_token.user.driver
-    order = Order.objects.get(id = request.POST["order_id"], driver = driver)
-    order.status = Order.DELIVERED
-    order.save()
-    return JsonResponse({"status": "success"})
+    driver = tokens.get_driver(request.POST.get("access_token"))
+    if lifecycle.transition(request.POST["order_id"], Order.ONTHEWAY, Order.DELIVERED, conditions = {"driver": driver}):
+        return JsonResponse({"status": "success"})
+    return JsonResponse({"status": "failed", "error": "This order is not on the way with you"})
 
 def driver_get_revenue(request):
-    access_token = AccessToken.objects.get(token = request.GET.get("access_token"), expires__gt = timezone.now())
-
-    driver = access_token.user.driver
-
-
-    from datetime import timedelta
+    driver = tokens.get_driver(request.GET.get("access_token"))
 
-    revenue = {}
-    today = timezone.now()
-    current_weekdays = [today + timedelta(days = i) for i in range(0 - today.weekday(), 7 - today.weekday())]
 
-    for day in current_weekdays:
-        orders = Order.objects.filter(
-            driver = driver,
-            status = Order.DELIVERED,
-            created_at__year = day.year,
-            created_at__month = day.month,
-            created_at__day = day.day
-        )
-
-        revenue[day.strftime("%a")] = sum(order.total for order in orders)
+    totals = reports.daily_totals(
+        Order.objects.filter(driver = driver, status = Order.DELIVERED),
+        reports.current_week(),
+        cache_key = "revenue:driver:%s" % driver.id
+    )
+    revenue = dict((day.strftime("%a"), day_revenue) for day, (day_revenue, count) in totals.items())
 
     return JsonResponse({"revenue": revenue})
 
@@ -271,13 +292,13 @@ def driver_get_revenue(request):
 @csrf_exempt
 def driver_update_location(request):
     if request.method == "POST":
-        access_token = AccessToken.objects.get(token = request.POST.get("access_token"), expires__gt = timezone.now())
-
-        driver = access_token.user.driver
+        driver = tokens.get_driver(request.POST.get("access_token"))
 
-        #Set Location String
-        driver.location = request.POST["location"]
-        driver.save()
+        #Set Location, it is written to the database in batches
+        coordinates = locations.parse_location(request.POST["location"])
+        if coordinates is None:
+            return JsonResponse({"status": "failed", "error": "Location must be latitude,longitude"})
+        locations.store.update(driver.id, coordinates[0], coordinates[1], request.POST["location"])
 
         return JsonResponse({"status": "success"})
 
@@ -285,31 +306,27 @@ def get_open_restaurants_near_customer(request):
     '''
     Returns a list of 10 restaurants which are open and near the user
     Latitude and longitude of the customer are required.
-    If the starting id of the restaurant is provided, results are filtered 
-    on restaurants having id more than that of the provided id
+    Pages are ordered by id, pass the returned next_cursor to get the next
+    one. The starting_id of older clients is still accepted as a cursor.
     :param request: http request
     :return: list of restaurants, each entry a dict of the restaurant's attributes
     '''
-    from haversine import haversine
     latitude = float(request.GET.get('latitude'))
     longitude = float(request.GET.get('longitude'))
     starting_id = request.GET.get('starting_id')
     batch_size = int(request.GET.get('batch_size', 10))
     operating_distance = int(request.GET.get('distance', 5))
-    if starting_id:
-        restaurants = Restaurant.objects.filter(id__gt=starting_id).order_by('id')
-    else:
-        restaurants = Restaurant.objects.all().order_by('id')
-
-    restaurants_within_distance = []
-    for restaurant in restaurants:
-        distance = None
-        if restaurant.latitude and restaurant.longitude:
-            distance = haversine((latitude, longitude), (restaurant.latitude, restaurant.longitude))
-        if distance and distance <= operating_distance and restaurant.is_open():
-            restaurants_within_distance.append(restaurant)
-        if len(restaurants_within_distance) >= batch_size:
-            break
+    try:
+        pagination = CursorPagination(request, ordering='id', page_size=batch_size)
+    except InvalidCursor as error:
+        return JsonResponse({'status': 'failed', 'error': str(error)})
+    if starting_id and pagination.position is None:
+        pagination.position = int(starting_id)
+
+    # closed restaurants are filtered out in SQL along with the distant ones
+    nearby = geo.restaurants_within(latitude, longitude, operating_distance,
+                                    pagination.filter(Restaurant.objects.open_now()))
+    restaurants_within_distance, next_cursor = pagination.page(restaurant for restaurant, distance in nearby)
 
     serialized_restaurants = RestaurantSerializer(
         restaurants_within_distance,
@@ -317,20 +334,10 @@ def get_open_restaurants_near_customer(request):
         context={"request": request}
     ).data
 
-    return JsonResponse({"restaurants": serialized_restaurants})
+    return JsonResponse({"restaurants": serialized_restaurants, "next_cursor": next_cursor})
 
 def get_meal_modifiers(request, restaurant_id):
-    meals = Meal.objects.filter(restaurant_id=restaurant_id)
-    modifiers = defaultdict(list)
-    for meal in meals:
-        meal_modifiers = meal.modifier.all()
-        for meal_modifier in meal_modifiers:
-            modifiers[meal_modifier].append(meal)
-    meal_extras = dict()
-    for modifier in modifiers.keys():
-        meal_extras[modifier.name] = MealSerializer(modifiers[modifier], many=True, context={'request': request}).data
-
-    return JsonResponse({"modifiers": meal_extras})
+    return catalog.modifiers_response(request, restaurant_id)
 
 def get_oldest_order(request):
     '''
@@ -354,14 +361,21 @@ def get_oldest_order(request):
     latitude = float(latitude)
     longitude = float(longitude)
 
-    # cycle through orders which are ready sorted by order created on time
-    # return first order which is in the vicinity of the driver
-    open_orders = Order.objects.filter(status=Order.READY).order_by('created_at')
-    for order in open_orders:
-        if order.restaurant.get_distance(latitude, longitude) <= 5:
-            return JsonResponse({'order': OrderSerializer(order).data})
+    # oldest ready order from any restaurant in the vicinity of the driver
+    nearby_restaurants = [restaurant for restaurant, distance in geo.restaurants_within(latitude, longitude, 5)]
+    order = Order.objects.with_details().filter(status=Order.READY, restaurant__in=nearby_restaurants).order_by('created_at').first()
+    if order:
+        return JsonResponse({'order': OrderSerializer(order).data})
 
     return JsonResponse({
         "status": "success",
         "message": "No orders are ready in your vicinity"
     })
+
+
+def metrics(request):
+    '''
+    Per-endpoint latency, query and response size histograms of this
+    process, in the Prometheus text format
+    '''
+    return profiling.metrics_response(request)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class FoodtaskerappConfig(AppConfig):
     name = 'foodtaskerapp'
+
+    def ready(self):
+        # Connect the signal handlers
+        from foodtaskerapp import catalog, dbpool, lifecycle, notifications, reports, signals, tokens
@@ -0,0 +1,235 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.db import transaction
+from django.conf import settings
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils import timezone
+
+from foodtaskerapp.encoding import FastJsonResponse, dumps
+from foodtaskerapp.models import CacheVersion, Meal, MealCategory, Modifier, Restaurant
+from foodtaskerapp.pagination import CursorPagination, InvalidCursor, is_paginated
+from foodtaskerapp.serializers import fast_meals, fast_restaurants
+
+CATALOG_KEY = 'catalog'
+
+
+def render(document):
+    return dumps(document)
+
+
+def etag_matches(request, etag):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+    return etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+
+
+def cached_response(request, etag, content):
+    '''
+    304 if the client already has this version, the pre-rendered JSON otherwise
+    '''
+    if etag_matches(request, etag):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(content, content_type='application/json')
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+_open_now = {}
+_open_now_lock = threading.Lock()
+
+
+def open_restaurant_ids():
+    '''
+    Ids of the restaurants open right now, queried at most once a minute
+    '''
+    minute = timezone.now().replace(second=0, microsecond=0)
+    with _open_now_lock:
+        if minute not in _open_now:
+            _open_now.clear()
+            _open_now[minute] = frozenset(Restaurant.objects.open_now().values_list('id', flat=True))
+        return _open_now[minute]
+
+
+class Catalog(object):
+    '''
+    The serialized restaurants for one catalog version and site. Whether a
+    restaurant is open changes with the time of day and not with a save, so
+    is_open is filled in from open_restaurant_ids() when rendering.
+    '''
+
+    def __init__(self, version, request):
+        self.version = version
+        self.restaurants = fast_restaurants(Restaurant.objects.all().order_by("-id"), request)
+        self.lock = threading.Lock()
+        self.minute = None
+        self.rendered = None
+
+    def render(self):
+        '''
+        :return: (etag, JSON bytes) of the catalog as of now
+        '''
+        minute = timezone.now().replace(second=0, microsecond=0)
+        with self.lock:
+            if self.minute != minute:
+                open_ids = open_restaurant_ids()
+                digest = hashlib.md5(','.join(map(str, sorted(open_ids))).encode('utf-8')).hexdigest()[:12]
+                etag = '"%s-%s"' % (self.version, digest)
+                if self.rendered is None or self.rendered[0] != etag:
+                    for restaurant in self.restaurants:
+                        restaurant['is_open'] = restaurant['id'] in open_ids
+                    self.rendered = (etag, render({"restaurants": self.restaurants}))
+                self.minute = minute
+            return self.rendered
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(request):
+    '''
+    Return the current catalog, building it if any restaurant changed since
+    this process last built it. Logo urls are absolute, so there is one per site.
+    '''
+    version = CacheVersion.get(CATALOG_KEY)
+    site = request.build_absolute_uri('/')
+    with _catalogs_lock:
+        catalog = _catalogs.get(site)
+        if catalog is None or catalog.version != version:
+            catalog = _catalogs[site] = Catalog(version, request)
+    return catalog
+
+
+def page_response(request, name, items):
+    '''
+    One page of a cached list, newest first
+    '''
+    try:
+        pagination = CursorPagination(request, ordering="-id")
+    except InvalidCursor as error:
+        return FastJsonResponse({"status": "failed", "error": str(error)})
+    page, next_cursor = pagination.paginate_list(items, key=lambda item: item["id"])
+    return FastJsonResponse({name: page, "next_cursor": next_cursor})
+
+
+def restaurants_response(request):
+    catalog = get_catalog(request)
+    etag, content = catalog.render()
+    if is_paginated(request):
+        return page_response(request, "restaurants", catalog.restaurants)
+    return cached_response(request, etag, content)
+
+
+def menu_key(restaurant_id):
+    return 'menu:%s' % restaurant_id
+
+
+class Menu(object):
+    '''
+    Snapshot of a restaurant's meals, categories and modifier groups, built
+    with three queries and kept pre-rendered for every endpoint serving it
+    '''
+
+    def __init__(self, version, restaurant_id, request):
+        self.version = version
+        meals = fast_meals(Meal.objects.filter(restaurant_id = restaurant_id).order_by("-id"), request)
+        serialized = [meal for meal, category_id in meals]
+
+        meal_modifiers = {}
+        for meal_id, modifier_id, modifier_name in Meal.modifier.through.objects\
+                .filter(meal__restaurant_id = restaurant_id).order_by("id")\
+                .values_list("meal_id", "modifier_id", "modifier__name"):
+            meal_modifiers.setdefault(meal_id, []).append((modifier_id, modifier_name))
+
+        modifiers = OrderedDict()
+        for data in serialized:
+            for modifier in meal_modifiers.get(data["id"], ()):
+                modifiers.setdefault(modifier, []).append(data)
+        meal_extras = dict((name, modifier_meals) for (modifier_id, name), modifier_meals in modifiers.items())
+
+        categories = MealCategory.objects.filter(restaurant_id = restaurant_id).order_by("-id").values("id", "name")
+
+        self.etag = '"%s"' % version
+        self.meal_list = serialized
+        self.meals = render({"meals": serialized})
+        self.modifiers = render({"modifiers": meal_extras})
+        self.menu = render({
+            "meals": serialized,
+            "categories": [dict(category, meals = [meal["id"] for meal, category_id in meals
+                                                   if category_id == category["id"]])
+                           for category in categories],
+            "modifiers": meal_extras,
+        })
+
+
+_menus = OrderedDict()
+_menus_lock = threading.Lock()
+
+
+def get_menu(request, restaurant_id):
+    '''
+    Return the current menu snapshot of a restaurant, rebuilding it when the
+    restaurant edited its menu. The last MENU_CACHE_SIZE menus are kept.
+    '''
+    version = CacheVersion.get(menu_key(restaurant_id))
+    key = (request.build_absolute_uri('/'), int(restaurant_id))
+    with _menus_lock:
+        menu = _menus.get(key)
+        if menu is not None and menu.version == version:
+            _menus.move_to_end(key)
+            return menu
+
+    menu = Menu(version, restaurant_id, request)
+    with _menus_lock:
+        _menus[key] = menu
+        while len(_menus) > getattr(settings, 'MENU_CACHE_SIZE', 500):
+            _menus.popitem(last=False)
+    return menu
+
+
+def meals_response(request, restaurant_id):
+    menu = get_menu(request, restaurant_id)
+    if is_paginated(request):
+        return page_response(request, "meals", menu.meal_list)
+    return cached_response(request, menu.etag, menu.meals)
+
+
+def modifiers_response(request, restaurant_id):
+    menu = get_menu(request, restaurant_id)
+    return cached_response(request, menu.etag, menu.modifiers)
+
+
+def menu_response(request, restaurant_id):
+    menu = get_menu(request, restaurant_id)
+    return cached_response(request, menu.etag, menu.menu)
+
+
+@receiver(post_save, sender=Restaurant, dispatch_uid='catalog_restaurant_saved')
+@receiver(post_delete, sender=Restaurant, dispatch_uid='catalog_restaurant_deleted')
+def bump_catalog_version(sender, **kwargs):
+    # only once committed, or another process could rebuild from stale rows
+    transaction.on_commit(lambda: CacheVersion.bump(CATALOG_KEY))
+    with _open_now_lock:
+        _open_now.clear()
+
+
+@receiver(post_save, sender=Meal, dispatch_uid='catalog_meal_saved')
+@receiver(post_delete, sender=Meal, dispatch_uid='catalog_meal_deleted')
+@receiver(post_save, sender=MealCategory, dispatch_uid='catalog_category_saved')
+@receiver(post_delete, sender=MealCategory, dispatch_uid='catalog_category_deleted')
+@receiver(post_save, sender=Modifier, dispatch_uid='catalog_modifier_saved')
+@receiver(post_delete, sender=Modifier, dispatch_uid='catalog_modifier_deleted')
+def bump_menu_version(sender, instance, **kwargs):
+    restaurant_id = instance.restaurant_id
+    transaction.on_commit(lambda: CacheVersion.bump(menu_key(restaurant_id)))
+
+
+@receiver(m2m_changed, sender=Meal.modifier.through, dispatch_uid='catalog_meal_modifiers_changed')
+def bump_menu_version_for_modifiers(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_menu_version(sender, instance)
@@ -0,0 +1,116 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import request_finished, request_started
+from django.db import DEFAULT_DB_ALIAS, connection
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+# Every thread keeps its own persistent connection for CONN_MAX_AGE seconds.
+# The per-process pool is the set of request threads holding one: past
+# DATABASE_POOL_SIZE, connections are closed when their request ends.
+# Background threads close their own connections and are not counted.
+
+_local = threading.local()
+
+
+class PoolStats(object):
+    COUNTERS = (
+        ('checkouts', 'Requests started'),
+        ('reused', 'Requests started on an open persistent connection'),
+        ('opened', 'Database connections opened'),
+        ('health_checks', 'Persistent connections checked before reuse'),
+        ('unusable', 'Persistent connections found broken and closed'),
+        ('released', 'Connections closed to keep the pool size'),
+    )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.open = set()
+        self.counts = dict((name, 0) for name, help_text in self.COUNTERS)
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def opened(self):
+        with self.lock:
+            self.open.add(threading.get_ident())
+
+    def closed(self):
+        with self.lock:
+            self.open.discard(threading.get_ident())
+
+    def size(self):
+        with self.lock:
+            return len(self.open)
+
+    def render(self):
+        '''
+        :return: the pool metrics in the Prometheus text exposition format
+        '''
+        lines = [
+            '# HELP foodtasker_db_connections_open Open database connections of the request threads of this process',
+            '# TYPE foodtasker_db_connections_open gauge',
+            'foodtasker_db_connections_open %d' % self.size(),
+        ]
+        with self.lock:
+            for name, help_text in self.COUNTERS:
+                lines.append('# HELP foodtasker_db_%s_total %s' % (name, help_text))
+                lines.append('# TYPE foodtasker_db_%s_total counter' % name)
+                lines.append('foodtasker_db_%s_total %d' % (name, self.counts[name]))
+        return '\n'.join(lines) + '\n'
+
+
+stats = PoolStats()
+
+
+def is_open():
+    return connection.connection is not None
+
+
+@receiver(connection_created, dispatch_uid='dbpool_connection_created')
+def connection_opened(sender, connection, **kwargs):
+    if connection.alias == DEFAULT_DB_ALIAS:
+        stats.count('opened')
+        if getattr(_local, 'in_request', False):
+            stats.opened()
+
+
+@receiver(request_started, dispatch_uid='dbpool_request_started')
+def check_out(sender, **kwargs):
+    '''
+    Runs after Django closed the connection if it is past CONN_MAX_AGE.
+    A connection idle for DATABASE_HEALTH_CHECK_AFTER seconds is tested
+    before use: the server or a proxy may have dropped it meanwhile.
+    '''
+    _local.in_request = True
+    stats.count('checkouts')
+    if not is_open():
+        stats.closed()
+        return
+    stats.count('reused')
+
+    idle = time.time() - getattr(_local, 'released_at', 0)
+    if idle >= getattr(settings, 'DATABASE_HEALTH_CHECK_AFTER', 30):
+        stats.count('health_checks')
+        if not connection.is_usable():
+            stats.count('unusable')
+            connection.close()
+            stats.closed()
+
+
+@receiver(request_finished, dispatch_uid='dbpool_request_finished')
+def release(sender, **kwargs):
+    _local.in_request = False
+    if not is_open():
+        stats.closed()
+        return
+    pool_size = getattr(settings, 'DATABASE_POOL_SIZE', None)
+    if pool_size is not None and stats.size() > pool_size and connection.get_autocommit():
+        stats.count('released')
+        connection.close()
+        stats.closed()
+        return
+    _local.released_at = time.time()
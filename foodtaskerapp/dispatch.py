@@ -0,0 +1,143 @@
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from foodtaskerapp import distance, geo, lifecycle
+from foodtaskerapp.models import DispatchOffer, Driver, Order
+
+# Drivers start at different offsets among the closest orders, so drivers
+# standing at the same restaurant do not all race for the same order
+CLAIM_SPREAD = 5
+
+
+def claim_order(order_id, driver):
+    '''
+    Give a READY order to a driver with a single conditional UPDATE. Only
+    one of any number of concurrent claims of an order can succeed.
+    :return: True if the driver got the order
+    '''
+    with transaction.atomic():
+        # Claims of one driver wait for each other, so they cannot both pass
+        # the active order check. Claims of different drivers do not wait.
+        if lifecycle.active_order_id(driver, lock=True) is not None:
+            return False
+        order = lifecycle.transition(order_id, Order.READY, Order.ONTHEWAY, conditions={'driver': None}, driver=driver)
+    return order is not None
+
+
+def claim_next_order(driver, latitude, longitude, distance=5, attempts=10):
+    '''
+    Claim the best READY order for a driver: orders of the closest
+    restaurants first, oldest first within a restaurant. Orders taken by
+    other drivers in the meantime are skipped.
+    :return: the claimed Order, or None
+    '''
+    restaurants = geo.closest_restaurants(latitude, longitude, distance)
+    if not restaurants:
+        return None
+    rank = dict((restaurant.id, position) for position, (restaurant, restaurant_distance) in enumerate(restaurants))
+
+    candidates = list(
+        Order.objects.filter(status=Order.READY, driver=None, restaurant_id__in=rank.keys())
+                     .order_by('created_at').values_list('id', 'restaurant_id')[:attempts * CLAIM_SPREAD]
+    )
+    candidates.sort(key=lambda candidate: rank[candidate[1]])
+
+    offset = driver.id % min(CLAIM_SPREAD, len(candidates)) if candidates else 0
+    for order_id, restaurant_id in (candidates[offset:] + candidates[:offset])[:attempts]:
+        if claim_order(order_id, driver):
+            return Order.objects.with_details().get(id=order_id)
+    return None
+
+
+def available_drivers(now=None):
+    '''
+    Drivers who reported their position recently and are not delivering
+    :return: list of (driver id, latitude, longitude)
+    '''
+    if now is None:
+        now = timezone.now()
+    online_since = now - timedelta(seconds=getattr(settings, 'DISPATCH_DRIVER_TIMEOUT', 120))
+    return list(
+        Driver.objects.filter(location_updated_at__gte=online_since, latitude__isnull=False, longitude__isnull=False,
+                              active_order=None)
+                      .values_list('id', 'latitude', 'longitude')
+    )
+
+
+def ready_orders():
+    '''
+    READY orders with the position of their restaurant, oldest first
+    :return: list of (order id, latitude, longitude)
+    '''
+    return list(
+        Order.objects.filter(status=Order.READY, driver=None,
+                             restaurant__latitude__isnull=False, restaurant__longitude__isnull=False)
+                     .order_by('created_at')
+                     .values_list('id', 'restaurant__latitude', 'restaurant__longitude')
+    )
+
+
+def match(drivers, orders, max_distance=5):
+    '''
+    Greedily pair drivers with orders, closest pairs first. Ties go to the
+    older order, as orders are passed oldest first.
+    :param drivers: list of (driver id, latitude, longitude)
+    :param orders: list of (order id, latitude, longitude)
+    :return: list of (driver id, order id, distance)
+    '''
+    if not drivers or not orders:
+        return []
+    costs = distance.haversine(distance.pack((latitude, longitude) for _, latitude, longitude in drivers),
+                               distance.pack((latitude, longitude) for _, latitude, longitude in orders))
+
+    assignments = []
+    assigned_drivers = set()
+    assigned_orders = set()
+    for index in np.argsort(costs, axis=None, kind='mergesort'):
+        driver_index, order_index = divmod(int(index), len(orders))
+        cost = costs[driver_index, order_index]
+        if cost > max_distance:
+            break
+        if driver_index in assigned_drivers or order_index in assigned_orders:
+            continue
+        assigned_drivers.add(driver_index)
+        assigned_orders.add(order_index)
+        assignments.append((drivers[driver_index][0], orders[order_index][0], float(cost)))
+        if len(assigned_drivers) == len(drivers) or len(assigned_orders) == len(orders):
+            break
+    return assignments
+
+
+def dispatch():
+    '''
+    Match every available driver with a READY order and replace the
+    published offers with the result
+    :return: number of offers published
+    '''
+    now = timezone.now()
+    assignments = match(available_drivers(now), ready_orders())
+    with transaction.atomic():
+        DispatchOffer.objects.all().delete()
+        DispatchOffer.objects.bulk_create([
+            DispatchOffer(driver_id=driver_id, order_id=order_id, distance=order_distance, created_at=now)
+            for driver_id, order_id, order_distance in assignments
+        ])
+    return len(assignments)
+
+
+def current_offer(driver):
+    '''
+    The order offered to the driver by the last dispatch run, if it is
+    still recent and nobody claimed the order in the meantime
+    '''
+    interval = getattr(settings, 'DISPATCH_INTERVAL', 10)
+    return Order.objects.with_details().filter(
+        offer__driver=driver,
+        offer__created_at__gte=timezone.now() - timedelta(seconds=3 * interval),
+        status=Order.READY,
+        driver=None
+    ).first()
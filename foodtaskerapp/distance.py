@@ -0,0 +1,63 @@
+import numpy as np
+
+# Mean earth radius in kms, same value the haversine package uses
+EARTH_RADIUS = 6371.0
+
+
+def pack(coordinates):
+    '''
+    Pack (latitude, longitude) pairs into a float array of shape (n, 2).
+    Accepts Decimals, floats or strings, as stored on the models.
+    :param coordinates: iterable of (latitude, longitude) pairs
+    :return: numpy array of degrees
+    '''
+    packed = np.array([(float(latitude), float(longitude)) for latitude, longitude in coordinates],
+                      dtype=np.float64)
+    return packed.reshape(-1, 2)
+
+
+def haversine(points, coordinates):
+    '''
+    Great circle distance between query points and packed coordinates,
+    computed in a single vectorized pass.
+    :param points: one (latitude, longitude) pair or an array of shape (m, 2)
+    :param coordinates: packed array of shape (n, 2), see pack()
+    :return: distances in kms, shape (n,) for one point or (m, n) for many
+    '''
+    points = np.asarray(points, dtype=np.float64)
+    single = points.ndim == 1
+    points = np.radians(points.reshape(-1, 2))
+    coordinates = np.radians(np.asarray(coordinates, dtype=np.float64).reshape(-1, 2))
+
+    latitudes = points[:, 0, np.newaxis]
+    longitudes = points[:, 1, np.newaxis]
+    d_latitude = coordinates[:, 0] - latitudes
+    d_longitude = coordinates[:, 1] - longitudes
+
+    a = np.sin(d_latitude / 2) ** 2 + np.cos(latitudes) * np.cos(coordinates[:, 0]) * np.sin(d_longitude / 2) ** 2
+    distances = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+    return distances[0] if single else distances
+
+
+def rank(point, coordinates, max_distance=None, limit=None):
+    '''
+    Rank packed coordinates by their distance to a point.
+    :param point: (latitude, longitude) pair
+    :param coordinates: packed array of shape (n, 2), see pack()
+    :param max_distance: optional radius in kms, farther entries are dropped
+    :param limit: optional number of closest entries to return
+    :return: (indices, distances) arrays, closest first
+    '''
+    distances = haversine(point, coordinates)
+    indices = np.arange(len(distances))
+    if max_distance is not None:
+        indices = indices[distances <= max_distance]
+
+    if limit is not None and limit < len(indices):
+        # partial sort, only the closest entries need to be ordered
+        closest = np.argpartition(distances[indices], limit)[:limit]
+        indices = indices[closest]
+
+    indices = indices[np.argsort(distances[indices], kind='mergesort')]
+    return indices, distances[indices]
@@ -0,0 +1,156 @@
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+# Renditions are named by their content, see foodtaskerapp.images
+IMMUTABLE_PREFIXES = ('renditions/',)
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+class StaticFilesStorage(CompressedManifestStaticFilesStorage):
+    '''
+    Hashed and compressed static files. Some vendored stylesheets point at
+    images and fonts which were never shipped, those url()s are left as
+    they are instead of failing collectstatic.
+    '''
+
+    def url_converter(self, name, *args, **kwargs):
+        converter = super(StaticFilesStorage, self).url_converter(name, *args, **kwargs)
+
+        def convert(matchobj):
+            try:
+                return converter(matchobj)
+            except ValueError:
+                return matchobj.group(0)
+        return convert
+
+
+_range = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, size):
+    '''
+    :return: (start, end) of a single byte range, end included, None to
+             send the whole file
+    :raises ValueError: if the range is not satisfiable
+    '''
+    match = _range.match(header.strip())
+    if match is None:
+        # several ranges or another unit, answering with the whole file is allowed
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # the last n bytes
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+class FileRange(object):
+    '''
+    Reads at most length bytes of a file from its current position. It
+    keeps fileno(), so servers with sendfile() still use it.
+    '''
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size) if size else b''
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def media_response(request, path):
+    '''
+    Serve a file from MEDIA_ROOT with validators, Range support and cache
+    headers. The body is a FileResponse, so gunicorn hands it to sendfile()
+    without copying it through Python. With MEDIA_ACCEL_REDIRECT set, the
+    front web server sends the file instead and the worker is free at once.
+    '''
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except ValueError:
+        raise Http404
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    etag = '"%x-%x"' % (int(stat.st_mtime), stat.st_size)
+    last_modified = http_date(stat.st_mtime)
+    if path.startswith(IMMUTABLE_PREFIXES):
+        cache_control = 'public, max-age=%d, immutable' % IMMUTABLE_MAX_AGE
+    else:
+        cache_control = 'public, max-age=%d' % getattr(settings, 'MEDIA_MAX_AGE', 3600)
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    if (if_none_match and etag in [tag.strip() for tag in if_none_match.split(',')]) or \
+            (not if_none_match and if_modified_since and int(stat.st_mtime) <= if_modified_since):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        response['Cache-Control'] = cache_control
+        return response
+
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+
+    accel_redirect = getattr(settings, 'MEDIA_ACCEL_REDIRECT', None)
+    if accel_redirect:
+        # the front web server handles ranges and sends the file itself
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = accel_redirect.rstrip('/') + '/' + path
+    else:
+        byte_range = None
+        # If-Range: only honour the range if the client has this version
+        if 'HTTP_RANGE' in request.META and request.META.get('HTTP_IF_RANGE', etag) in (etag, last_modified):
+            try:
+                byte_range = parse_range(request.META['HTTP_RANGE'], stat.st_size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = 'bytes */%d' % stat.st_size
+                return response
+
+        file = open(full_path, 'rb')
+        if byte_range is None:
+            response = FileResponse(file, content_type=content_type)
+            response['Content-Length'] = stat.st_size
+        else:
+            start, end = byte_range
+            file.seek(start)
+            # gunicorn's sendfile() starts at the file position and stops at Content-Length
+            response = FileResponse(FileRange(file, end - start + 1), content_type=content_type, status=206)
+            response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, stat.st_size)
+            response['Content-Length'] = end - start + 1
+        response['Accept-Ranges'] = 'bytes'
+
+    if encoding:
+        response['Content-Encoding'] = encoding
+    response['ETag'] = etag
+    response['Last-Modified'] = last_modified
+    response['Cache-Control'] = cache_control
+    return response
@@ -0,0 +1,85 @@
+import math
+
+from foodtaskerapp import distance as batch_distance
+from foodtaskerapp.distance import EARTH_RADIUS
+from foodtaskerapp.models import Restaurant
+
+KM_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+
+
+def bounding_box(latitude, longitude, distance):
+    '''
+    Return the latitude/longitude box which contains every point within
+    distance kms of the given point. The box is slightly larger than the
+    circle, so candidates still have to be checked with the exact distance.
+    :param latitude: Latitude of the centre
+    :param longitude: Longitude of the centre
+    :param distance: radius in kms
+    :return: (min_latitude, max_latitude, min_longitude, max_longitude)
+    '''
+    delta_latitude = distance / KM_PER_DEGREE
+    min_latitude = max(latitude - delta_latitude, -90.0)
+    max_latitude = min(latitude + delta_latitude, 90.0)
+
+    # Close to the poles, or across the antimeridian, any longitude may match
+    if min_latitude <= -90.0 or max_latitude >= 90.0:
+        return min_latitude, max_latitude, -180.0, 180.0
+    delta_longitude = math.degrees(
+        math.asin(min(math.sin(math.radians(delta_latitude)) / math.cos(math.radians(latitude)), 1.0))
+    )
+    if longitude - delta_longitude < -180.0 or longitude + delta_longitude > 180.0:
+        return min_latitude, max_latitude, -180.0, 180.0
+
+    return min_latitude, max_latitude, longitude - delta_longitude, longitude + delta_longitude
+
+
+def restaurants_in_box(latitude, longitude, distance, queryset=None):
+    '''
+    Narrow a restaurant queryset to the bounding box around a point.
+    Restaurants without co-ordinates are never returned.
+    '''
+    if queryset is None:
+        queryset = Restaurant.objects.all()
+    min_latitude, max_latitude, min_longitude, max_longitude = bounding_box(latitude, longitude, distance)
+
+    return queryset.filter(
+        latitude__range=(min_latitude, max_latitude),
+        longitude__range=(min_longitude, max_longitude),
+    )
+
+
+def restaurants_within(latitude, longitude, distance, queryset=None):
+    '''
+    Return the restaurants within distance kms of a point. The bounding box
+    is resolved in SQL and the exact haversine distance is only computed for
+    the rows inside it.
+    :param latitude: Latitude of the point
+    :param longitude: Longitude of the point
+    :param distance: radius in kms
+    :param queryset: optional restaurant queryset to search in
+    :return: list of (restaurant, distance) tuples, in queryset order
+    '''
+    candidates = list(restaurants_in_box(latitude, longitude, distance, queryset))
+    if not candidates:
+        return []
+
+    coordinates = batch_distance.pack((restaurant.latitude, restaurant.longitude) for restaurant in candidates)
+    distances = batch_distance.haversine((latitude, longitude), coordinates)
+
+    return [(restaurant, float(restaurant_distance))
+            for restaurant, restaurant_distance in zip(candidates, distances)
+            if restaurant_distance <= distance]
+
+
+def closest_restaurants(latitude, longitude, distance, limit=None, queryset=None):
+    '''
+    Same as restaurants_within, but ordered by distance, closest first.
+    '''
+    candidates = list(restaurants_in_box(latitude, longitude, distance, queryset))
+    if not candidates:
+        return []
+
+    coordinates = batch_distance.pack((restaurant.latitude, restaurant.longitude) for restaurant in candidates)
+    indices, distances = batch_distance.rank((latitude, longitude), coordinates, max_distance=distance, limit=limit)
+
+    return [(candidates[index], float(restaurant_distance)) for index, restaurant_distance in zip(indices, distances)]
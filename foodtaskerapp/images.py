@@ -0,0 +1,157 @@
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps
+
+from foodtaskerapp import workers
+from foodtaskerapp.models import Meal, Restaurant
+
+logger = logging.getLogger(__name__)
+
+# Largest first, every rendition is scaled down from the previous one
+RENDITIONS = OrderedDict([
+    ('detail', (1080, 1080)),
+    ('list', (400, 400)),
+    ('thumb', (150, 150)),
+])
+
+# Thumbnails are cropped to a square, the other sizes keep the aspect ratio
+CROPPED = ('thumb',)
+
+FORMATS = OrderedDict([
+    ('webp', ('WEBP', {'quality': 80, 'method': 4})),
+    ('jpg', ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True})),
+])
+
+# (model, image field, hash field) of every image with renditions
+IMAGE_FIELDS = {
+    'meal': (Meal, 'image', 'image_hash'),
+    'restaurant': (Restaurant, 'logo', 'logo_hash'),
+}
+
+
+def content_hash(field_file):
+    digest = hashlib.sha1()
+    field_file.open('rb')
+    try:
+        for chunk in field_file.chunks():
+            digest.update(chunk)
+    finally:
+        field_file.close()
+    return digest.hexdigest()[:16]
+
+
+def rendition_name(name, digest, size, extension):
+    '''
+    Storage name of a rendition. It changes with the content of the
+    original, so the file can be cached forever.
+    '''
+    stem = os.path.splitext(name)[0]
+    return 'renditions/%s.%s.%s.%s' % (stem, digest, size, extension)
+
+
+def rendition_urls(name, digest, url=default_storage.url):
+    '''
+    :param name: storage name of the original image
+    :param url: turns a storage name into a url
+    :return: dict of size -> dict of format -> url, None until the renditions exist
+    '''
+    if not name or not digest:
+        return None
+    return OrderedDict(
+        (size, OrderedDict(
+            (extension, url(rendition_name(name, digest, size, extension)))
+            for extension in FORMATS
+        ))
+        for size in RENDITIONS
+    )
+
+
+def render(image, size, extension):
+    image_format, options = FORMATS[extension]
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    output = BytesIO()
+    image.save(output, image_format, **options)
+    return output.getvalue()
+
+
+def generate(field_file):
+    '''
+    Write every size and format of an image that is not in storage yet
+    :return: the content hash the rendition names are built from
+    '''
+    digest = content_hash(field_file)
+
+    field_file.open('rb')
+    try:
+        image = Image.open(field_file)
+        # JPEGs decode straight to a reduced scale, far cheaper than full resolution
+        image.draft('RGB', RENDITIONS['detail'])
+        image = ImageOps.exif_transpose(image) if hasattr(ImageOps, 'exif_transpose') else image
+        image.load()
+    finally:
+        field_file.close()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+
+    for size, dimensions in RENDITIONS.items():
+        if size in CROPPED:
+            scaled = ImageOps.fit(image, dimensions, Image.LANCZOS)
+        else:
+            scaled = image.copy()
+            scaled.thumbnail(dimensions, Image.LANCZOS)
+            image = scaled
+
+        for extension in FORMATS:
+            name = rendition_name(field_file.name, digest, size, extension)
+            if default_storage.exists(name):
+                continue
+            try:
+                content = render(scaled, size, extension)
+            except (IOError, KeyError):
+                # Pillow built without WebP support
+                logger.warning('Could not write %s rendition of %s', extension, field_file.name)
+                continue
+            default_storage.save(name, ContentFile(content))
+    return digest
+
+
+def generate_renditions(kind, instance_id):
+    '''
+    Generate the renditions of one image, then publish them by saving the
+    content hash, unless the image was replaced in the meantime
+    '''
+    model, image_field, hash_field = IMAGE_FIELDS[kind]
+    instance = model.objects.filter(id=instance_id).first()
+    if instance is None:
+        return None
+    field_file = getattr(instance, image_field)
+    if not field_file:
+        return None
+
+    digest = generate(field_file)
+    if getattr(instance, hash_field) != digest:
+        with transaction.atomic():
+            current = model.objects.select_for_update().filter(id=instance_id).first()
+            if current is not None and getattr(current, image_field).name == field_file.name:
+                setattr(current, hash_field, digest)
+                # saving rebuilds the cached catalog and menu with the new urls
+                current.save(update_fields=[hash_field])
+    return digest
+
+
+def enqueue_renditions(kind, instance):
+    '''
+    Generate the renditions of a saved image on the "images" worker pool,
+    once the current transaction commits
+    :param kind: key of IMAGE_FIELDS
+    '''
+    instance_id = instance.id
+    transaction.on_commit(lambda: workers.submit('images', generate_renditions, kind, instance_id))
@@ -0,0 +1,93 @@
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils import timezone
+
+from foodtaskerapp.models import Customer, Driver, Order
+from foodtaskerapp.signals import order_status_changed
+
+# Statuses an order can move to from each status
+TRANSITIONS = {
+    Order.PENDING_PAYMENT: (Order.PREPARING, Order.PAYMENT_FAILED),
+    Order.PREPARING: (Order.READY,),
+    Order.READY: (Order.ONTHEWAY,),
+    Order.ONTHEWAY: (Order.DELIVERED,),
+}
+
+# Field recording when the order entered a status
+TIMESTAMPS = {
+    Order.PREPARING: 'paid_at',
+    Order.READY: 'ready_at',
+    Order.ONTHEWAY: 'picked_at',
+    Order.DELIVERED: 'delivered_at',
+}
+
+# The customer can not place another order while one is in these statuses
+FINAL_STATUSES = (Order.DELIVERED, Order.PAYMENT_FAILED)
+
+# Paid orders the restaurant and the driver still have to work on
+ACTIVE_STATUSES = (Order.PREPARING, Order.READY, Order.ONTHEWAY)
+
+
+class InvalidTransition(ValueError):
+    pass
+
+
+def can_transition(source, target):
+    return target in TRANSITIONS.get(source, ())
+
+
+def transition(order_id, source, target, conditions=None, **changes):
+    '''
+    Move an order from source to target with a single conditional UPDATE,
+    recording the time of the transition. Of any number of concurrent
+    transitions of an order out of source, only one succeeds.
+    :param conditions: further lookups the order must match, e.g. its driver
+    :param changes: further fields to update along with the status
+    :return: the updated Order, or None if it was not in source status or did not match
+    '''
+    if not can_transition(source, target):
+        raise InvalidTransition('An order can not go from %s to %s' % (source, target))
+
+    now = timezone.now()
+    changes['status'] = target
+    # update() does not apply auto_now
+    changes['updated_at'] = now
+    if target in TIMESTAMPS:
+        changes[TIMESTAMPS[target]] = now
+
+    with transaction.atomic():
+        if not Order.objects.filter(id=order_id, status=source, **(conditions or {})).update(**changes):
+            return None
+        order = Order.objects.select_related('restaurant').get(id=order_id)
+        # receivers run in the transaction, the active order pointers change along with the status
+        order_status_changed.send(sender=Order, order=order, previous_status=source)
+    return order
+
+
+def active_order_id(owner, lock=False):
+    '''
+    The active order of a Customer or Driver, looked up by primary key as
+    the owner may come from the token cache
+    :param lock: lock the owner row until the end of the transaction
+    '''
+    owners = type(owner).objects.filter(id=owner.id)
+    if lock:
+        owners = owners.select_for_update()
+    return owners.values_list('active_order', flat=True).get()
+
+
+def has_active_order(owner):
+    return active_order_id(owner) is not None
+
+
+@receiver(order_status_changed, dispatch_uid='lifecycle_update_active_orders')
+def update_active_orders(sender, order, previous_status, **kwargs):
+    if previous_status is None and order.status not in FINAL_STATUSES:
+        Customer.objects.filter(id=order.customer_id).update(active_order=order.id)
+    elif order.status in FINAL_STATUSES:
+        Customer.objects.filter(id=order.customer_id, active_order=order.id).update(active_order=None)
+
+    if order.status == Order.ONTHEWAY and order.driver_id:
+        Driver.objects.filter(id=order.driver_id).update(active_order=order.id)
+    elif order.status == Order.DELIVERED and order.driver_id:
+        Driver.objects.filter(id=order.driver_id, active_order=order.id).update(active_order=None)
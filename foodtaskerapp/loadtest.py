@@ -0,0 +1,377 @@
+import json
+import math
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from oauth2_provider.models import AccessToken, Application
+
+from foodtaskerapp import reports
+from foodtaskerapp.models import (Customer, Driver, Meal, MealCategory, Modifier, Order, OrderDetails,
+                                  Restaurant)
+
+PREFIX = 'loadtest-'
+
+# Everything is seeded within a few km of this point
+CENTER = (-34.92, 138.60)
+
+
+def token_for(user):
+    return PREFIX + user.username
+
+
+def seed(restaurants=50, meals=20, customers=1000, drivers=200, orders=20000):
+    '''
+    Generate a city worth of users, menus and delivered order history. Every
+    row belongs to a user whose name starts with PREFIX, see clean().
+    :param meals: number of meals per restaurant
+    :param orders: number of delivered orders in the history
+    '''
+    random.seed(0)
+    now = timezone.now()
+
+    User.objects.bulk_create(
+        [User(username='%srestaurant-%d' % (PREFIX, i), first_name='Restaurant %d' % i) for i in range(restaurants)] +
+        [User(username='%scustomer-%d' % (PREFIX, i), first_name='Customer %d' % i) for i in range(customers)] +
+        [User(username='%sdriver-%d' % (PREFIX, i), first_name='Driver %d' % i) for i in range(drivers)]
+    )
+    users = User.objects.filter(username__startswith=PREFIX)
+
+    Restaurant.objects.bulk_create([
+        Restaurant(user=user, name=user.first_name, phone='0', address='%d Load Street' % i,
+                   logo='restaurant_logo/loadtest.png',
+                   latitude=Decimal('%.6f' % (CENTER[0] + random.uniform(-0.04, 0.04))),
+                   longitude=Decimal('%.6f' % (CENTER[1] + random.uniform(-0.04, 0.04))))
+        for i, user in enumerate(users.filter(username__startswith=PREFIX + 'restaurant-'))
+    ])
+    Customer.objects.bulk_create([
+        Customer(user=user, avatar='', address='Load Street')
+        for user in users.filter(username__startswith=PREFIX + 'customer-')
+    ])
+    Driver.objects.bulk_create([
+        Driver(user=user, avatar='') for user in users.filter(username__startswith=PREFIX + 'driver-')
+    ])
+
+    restaurant_list = list(Restaurant.objects.filter(user__username__startswith=PREFIX))
+    MealCategory.objects.bulk_create([
+        MealCategory(restaurant=restaurant, name='Category %d' % i) for restaurant in restaurant_list for i in range(4)
+    ])
+    Modifier.objects.bulk_create([
+        Modifier(restaurant=restaurant, name='Extra %d' % i) for restaurant in restaurant_list for i in range(5)
+    ])
+    categories = defaultdict(list)
+    for category in MealCategory.objects.filter(restaurant__in=restaurant_list):
+        categories[category.restaurant_id].append(category)
+    Meal.objects.bulk_create([
+        Meal(restaurant=restaurant, name='Meal %d' % i, short_description='A meal', image='meal_images/loadtest.png',
+             price=Decimal(random.randint(5, 30)), category=random.choice(categories[restaurant.id]))
+        for restaurant in restaurant_list for i in range(meals)
+    ])
+
+    meals_by_restaurant = defaultdict(list)
+    for meal in Meal.objects.filter(restaurant__in=restaurant_list):
+        meals_by_restaurant[meal.restaurant_id].append(meal)
+    modifiers = defaultdict(list)
+    for modifier in Modifier.objects.filter(restaurant__in=restaurant_list):
+        modifiers[modifier.restaurant_id].append(modifier)
+    Meal.modifier.through.objects.bulk_create([
+        Meal.modifier.through(meal_id=meal.id, modifier_id=modifier.id)
+        for restaurant_id, restaurant_meals in meals_by_restaurant.items()
+        for meal in restaurant_meals
+        for modifier in random.sample(modifiers[restaurant_id], 2)
+    ])
+
+    application = Application.objects.create(
+        name=PREFIX + 'app', user=restaurant_list[0].user,
+        client_type=Application.CLIENT_CONFIDENTIAL, authorization_grant_type=Application.GRANT_PASSWORD
+    )
+    AccessToken.objects.bulk_create([
+        AccessToken(user=user, application=application, token=token_for(user), scope='read write',
+                    expires=now + timedelta(days=365))
+        for user in users.filter(username__regex=r'^%s(customer|driver)-' % PREFIX)
+    ])
+
+    customer_ids = list(Customer.objects.filter(user__username__startswith=PREFIX).values_list('id', flat=True))
+    driver_ids = list(Driver.objects.filter(user__username__startswith=PREFIX).values_list('id', flat=True))
+    for start in range(0, orders, 1000):
+        history = []
+        lines = []
+        for _ in range(min(1000, orders - start)):
+            restaurant = random.choice(restaurant_list)
+            picked = random.sample(meals_by_restaurant[restaurant.id], random.randint(1, 3))
+            quantities = [random.randint(1, 3) for _ in picked]
+            created_at = now - timedelta(minutes=random.randint(60, 90 * 24 * 60))
+            order = Order(customer_id=random.choice(customer_ids), restaurant=restaurant,
+                          driver_id=random.choice(driver_ids), address='Load Street',
+                          total=sum(meal.price * quantity for meal, quantity in zip(picked, quantities)),
+                          status=Order.DELIVERED, created_at=created_at,
+                          paid_at=created_at + timedelta(minutes=1), ready_at=created_at + timedelta(minutes=15),
+                          picked_at=created_at + timedelta(minutes=20),
+                          delivered_at=created_at + timedelta(minutes=40))
+            history.append(order)
+            lines.append(list(zip(picked, quantities)))
+        Order.objects.bulk_create(history)
+        # bulk_create only sets primary keys on PostgreSQL, find the orders again by their unique payment key
+        ids = dict(Order.objects.filter(payment_key__in=[order.payment_key for order in history])
+                                .values_list('payment_key', 'id'))
+        OrderDetails.objects.bulk_create([
+            OrderDetails(order_id=ids[order.payment_key], meal=meal, quantity=quantity, sub_total=meal.price * quantity)
+            for order, order_lines in zip(history, lines)
+            for meal, quantity in order_lines
+        ])
+
+    reports.backfill_daily_sales([restaurant.id for restaurant in restaurant_list])
+
+
+def clean():
+    '''
+    Delete everything seed() and the scenarios created
+    '''
+    Order.objects.filter(restaurant__user__username__startswith=PREFIX).delete()
+    Application.objects.filter(name=PREFIX + 'app').delete()
+    User.objects.filter(username__startswith=PREFIX).delete()
+
+
+def is_seeded():
+    return User.objects.filter(username__startswith=PREFIX).exists()
+
+
+def percentile(values, fraction):
+    '''
+    Nearest-rank percentile of a sorted list
+    '''
+    if not values:
+        return 0
+    return values[min(len(values), max(1, int(math.ceil(fraction * len(values))))) - 1]
+
+
+class Recorder(object):
+    '''
+    Latency and query count of every request, per endpoint label
+    '''
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def add(self, label, duration, queries, failed):
+        with self.lock:
+            self.samples[label].append((duration, queries))
+            if failed:
+                self.errors[label] += 1
+
+    def summary(self):
+        '''
+        :return: dict of label -> dict of count, errors, p50, p95, p99 (ms), mean and max queries
+        '''
+        results = {}
+        with self.lock:
+            for label, samples in self.samples.items():
+                durations = sorted(duration * 1000 for duration, queries in samples)
+                queries = [count for duration, count in samples]
+                results[label] = {
+                    'count': len(samples),
+                    'errors': self.errors[label],
+                    'p50': percentile(durations, 0.50),
+                    'p95': percentile(durations, 0.95),
+                    'p99': percentile(durations, 0.99),
+                    'queries': sum(queries) / len(queries),
+                    'max_queries': max(queries),
+                }
+        return results
+
+
+class Session(object):
+    '''
+    A test client making requests in-process and recording each of them
+    '''
+
+    def __init__(self, recorder):
+        self.client = Client()
+        self.recorder = recorder
+
+    def request(self, label, method, path, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = getattr(self.client, method)(path, data or {})
+            if response.streaming:
+                b''.join(response.streaming_content)
+            duration = time.perf_counter() - start
+        failed = response.status_code >= 400 or self.failed(response)
+        self.recorder.add(label, duration, len(queries), failed)
+        return response
+
+    def failed(self, response):
+        if response.streaming or not response.get('Content-Type', '').startswith('application/json'):
+            return False
+        try:
+            body = json.loads(response.content.decode('utf-8'))
+        except ValueError:
+            return True
+        return isinstance(body, dict) and body.get('status') in ('failed', 'fail')
+
+    def get(self, label, path, data=None):
+        return self.request(label, 'get', path, data)
+
+    def post(self, label, path, data=None):
+        return self.request(label, 'post', path, data)
+
+
+class Population(object):
+    '''
+    The seeded users, handed out so that no two scenarios running at the
+    same time share a customer or a driver
+    '''
+
+    def __init__(self):
+        self.restaurants = list(Restaurant.objects.filter(user__username__startswith=PREFIX).select_related('user'))
+        self.menus = defaultdict(list)
+        for meal_id, restaurant_id in Meal.objects.filter(restaurant__in=self.restaurants)\
+                                                  .values_list('id', 'restaurant_id'):
+            self.menus[restaurant_id].append(meal_id)
+        self.customers = list(Customer.objects.filter(user__username__startswith=PREFIX, active_order=None)
+                                              .select_related('user'))
+        self.drivers = list(Driver.objects.filter(user__username__startswith=PREFIX, active_order=None)
+                                          .select_related('user'))
+        random.shuffle(self.customers)
+        random.shuffle(self.drivers)
+        self.lock = threading.Lock()
+
+    def take(self, pool):
+        with self.lock:
+            return pool.pop() if pool else None
+
+    def give_back(self, pool, item):
+        with self.lock:
+            pool.insert(0, item)
+
+
+def browse(session, population):
+    '''
+    A customer looking through restaurants and menus
+    '''
+    latitude, longitude = CENTER
+    session.get('customer restaurants', '/api/customer/restaurants/')
+    session.get('customer nearby restaurants', '/api/customer/nearby-restaurants/',
+                {'latitude': latitude, 'longitude': longitude})
+    for restaurant in random.sample(population.restaurants, min(3, len(population.restaurants))):
+        session.get('customer menu', '/api/customer/menu/%d/' % restaurant.id)
+        session.get('customer meals', '/api/customer/meals/%d/' % restaurant.id)
+        session.get('customer meal extras', '/api/meal-extras/%d/' % restaurant.id)
+
+
+def deliver(session, population, pings=5, payment_timeout=10):
+    '''
+    A customer orders with the stub gateway, the restaurant prepares the
+    order, a driver picks it up, reports its position on the way and
+    delivers it, while the customer follows the driver
+    '''
+    customer = population.take(population.customers)
+    driver = population.take(population.drivers)
+    try:
+        if customer is None or driver is None:
+            return
+        restaurant = random.choice(population.restaurants)
+        customer_token = token_for(customer.user)
+        driver_token = token_for(driver.user)
+        meals = random.sample(population.menus[restaurant.id], min(2, len(population.menus[restaurant.id])))
+
+        response = session.post('customer add order', '/api/customer/order/add/', {
+            'access_token': customer_token,
+            'restaurant_id': restaurant.id,
+            'address': 'Load Street',
+            'extra_notes': '',
+            'stripe_token': 'tok_visa',
+            'order_details': json.dumps([{'meal_id': meal_id, 'quantity': 1} for meal_id in meals]),
+        })
+        order_id = json.loads(response.content.decode('utf-8')).get('order_id')
+        if order_id is None:
+            return
+
+        # the payment is charged on a background worker
+        deadline = time.time() + payment_timeout
+        while Order.objects.filter(id=order_id, status=Order.PENDING_PAYMENT).exists() and time.time() < deadline:
+            session.get('customer latest order', '/api/customer/order/latest/', {'access_token': customer_token})
+            time.sleep(0.05)
+
+        session.client.force_login(restaurant.user, backend='django.contrib.auth.backends.ModelBackend')
+        session.get('restaurant orders', '/restaurant/order/')
+        session.post('restaurant order ready', '/restaurant/order/', {'id': order_id})
+        session.client.logout()
+
+        latitude, longitude = float(restaurant.latitude), float(restaurant.longitude)
+        session.get('driver ready orders', '/api/driver/orders/ready/', {'latitude': latitude, 'longitude': longitude})
+        session.get('driver offer', '/api/driver/order/offer/', {'access_token': driver_token})
+        session.post('driver pick order', '/api/driver/order/pick/', {'access_token': driver_token, 'order_id': order_id})
+        session.get('driver latest order', '/api/driver/order/latest/', {'access_token': driver_token})
+
+        for ping in range(pings):
+            latitude += random.uniform(-0.002, 0.002)
+            longitude += random.uniform(-0.002, 0.002)
+            session.post('driver update location', '/api/driver/location/update/', {
+                'access_token': driver_token, 'location': '%.6f,%.6f' % (latitude, longitude)
+            })
+            session.get('customer driver location', '/api/customer/driver/location/', {'access_token': customer_token})
+
+        session.post('driver complete order', '/api/driver/order/complete/',
+                     {'access_token': driver_token, 'order_id': order_id})
+        session.get('driver revenue', '/api/driver/revenue/', {'access_token': driver_token})
+    finally:
+        if customer is not None:
+            population.give_back(population.customers, customer)
+        if driver is not None:
+            population.give_back(population.drivers, driver)
+
+
+def dashboard(session, population):
+    '''
+    A restaurant owner watching orders and sales
+    '''
+    restaurant = random.choice(population.restaurants)
+    session.client.force_login(restaurant.user, backend='django.contrib.auth.backends.ModelBackend')
+    session.get('restaurant orders', '/restaurant/order/')
+    session.get('restaurant report', '/restaurant/report/')
+    session.client.logout()
+
+
+SCENARIOS = {
+    'browse': browse,
+    'deliver': deliver,
+    'dashboard': dashboard,
+}
+
+
+def run(scenarios, iterations, threads=1):
+    '''
+    Run every scenario iterations times in each of threads threads
+    :param scenarios: names from SCENARIOS
+    :return: Recorder with the results
+    '''
+    recorder = Recorder()
+    population = Population()
+
+    def worker():
+        session = Session(recorder)
+        try:
+            for _ in range(iterations):
+                for name in scenarios:
+                    SCENARIOS[name](session, population)
+        finally:
+            connection.close()
+
+    # every thread has its own client and database connection
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return recorder
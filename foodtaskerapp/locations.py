@@ -0,0 +1,143 @@
+import atexit
+import logging
+import threading
+import time
+from collections import namedtuple
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from foodtaskerapp.models import Driver, DriverLocation, Order
+
+logger = logging.getLogger(__name__)
+
+Position = namedtuple('Position', ('latitude', 'longitude', 'location', 'recorded_at'))
+
+
+def parse_location(location):
+    '''
+    Parse the "latitude,longitude" string sent by the driver app
+    :return: (latitude, longitude) Decimals, or None if it is not valid
+    '''
+    try:
+        latitude, longitude = [Decimal(part.strip()) for part in location.split(',')]
+    except (AttributeError, ValueError, InvalidOperation):
+        return None
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    return latitude.quantize(Decimal('0.000001')), longitude.quantize(Decimal('0.000001'))
+
+
+class LocationStore(object):
+    '''
+    Latest position of every driver, kept in memory and written to the
+    database in batches every LOCATION_FLUSH_INTERVAL seconds instead of
+    on every ping. While a driver is delivering an order, the pings are
+    also appended to the order's DriverLocation track.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latest = {}
+        self.dirty = set()
+        self.points = []
+        self.flusher = None
+
+    def update(self, driver_id, latitude, longitude, location):
+        position = Position(latitude, longitude, location, timezone.now())
+        with self.lock:
+            self.latest[driver_id] = position
+            self.dirty.add(driver_id)
+            self.points.append((driver_id, position))
+            if self.flusher is None:
+                self.start()
+
+    def get(self, driver_id):
+        '''
+        Latest position of a driver, or None if this process has not seen it
+        '''
+        with self.lock:
+            return self.latest.get(driver_id)
+
+    def current(self, driver_id):
+        '''
+        Latest known position of a driver. The pings of a driver may reach
+        any process, so the one kept here is only trusted for
+        LOCATION_FLUSH_INTERVAL seconds, the Driver row is used once the
+        other processes could have written a newer one.
+        :return: Position, or None if the driver never reported one
+        '''
+        position = self.get(driver_id)
+        fresh = timezone.now() - timedelta(seconds=getattr(settings, 'LOCATION_FLUSH_INTERVAL', 5))
+        if position is not None and position.recorded_at >= fresh:
+            return position
+
+        stored = Driver.objects.filter(id=driver_id)\
+            .values_list('latitude', 'longitude', 'location', 'location_updated_at').first()
+        if stored is None or stored[3] is None:
+            return position
+        stored = Position(*stored)
+        if position is None or stored.recorded_at > position.recorded_at:
+            return stored
+        return position
+
+    def positions(self):
+        with self.lock:
+            return dict(self.latest)
+
+    def start(self):
+        self.flusher = threading.Thread(target=self.run, name='location-flusher')
+        self.flusher.daemon = True
+        self.flusher.start()
+
+    def run(self):
+        interval = getattr(settings, 'LOCATION_FLUSH_INTERVAL', 5)
+        while True:
+            time.sleep(interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Could not write driver locations')
+            finally:
+                connection.close()
+
+    def flush(self):
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+            points, self.points = self.points, []
+            positions = dict((driver_id, self.latest[driver_id]) for driver_id in dirty)
+        if not positions:
+            return
+
+        with transaction.atomic():
+            for driver_id, position in positions.items():
+                # another process may already have written a newer ping
+                Driver.objects.filter(Q(location_updated_at__lt=position.recorded_at) |
+                                      Q(location_updated_at__isnull=True), id=driver_id).update(
+                    latitude=position.latitude,
+                    longitude=position.longitude,
+                    location=position.location,
+                    location_updated_at=position.recorded_at,
+                )
+
+            if getattr(settings, 'LOCATION_TRACK_DELIVERIES', True):
+                deliveries = dict(Order.objects.filter(driver_id__in=positions.keys(), status=Order.ONTHEWAY)
+                                  .values_list('driver_id', 'id'))
+                DriverLocation.objects.bulk_create([
+                    DriverLocation(
+                        driver_id=driver_id,
+                        order_id=deliveries[driver_id],
+                        latitude=position.latitude,
+                        longitude=position.longitude,
+                        recorded_at=position.recorded_at,
+                    )
+                    for driver_id, position in points if driver_id in deliveries
+                ])
+
+
+store = LocationStore()
+atexit.register(store.flush)
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from foodtaskerapp import reports
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the DailySales rollup from the delivered orders. '
+            'Orders delivered while it runs may be counted twice, run it when deliveries are quiet.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--restaurant', type=int, action='append', dest='restaurants',
+                            help='Only rebuild this restaurant id, may be repeated')
+
+    def handle(self, *args, **options):
+        rows = reports.backfill_daily_sales(options['restaurants'])
+        self.stdout.write('Wrote %d daily sales rows' % rows)
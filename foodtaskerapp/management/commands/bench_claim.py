@@ -0,0 +1,89 @@
+import threading
+import time
+from collections import Counter
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from foodtaskerapp import dispatch, lifecycle
+from foodtaskerapp.models import Customer, Driver, Order, Restaurant
+
+PREFIX = 'bench-claim-'
+
+
+class Command(BaseCommand):
+    help = ('Stress test order claiming: many drivers claim the same READY orders in parallel. '
+            'Creates its own restaurant, customer, drivers and orders and deletes them afterwards. '
+            'Run it against PostgreSQL, SQLite serializes every write.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drivers', type=int, default=100)
+        parser.add_argument('--orders', type=int, default=1000)
+        parser.add_argument('--keep', action='store_true', help='Keep the generated rows')
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username__startswith=PREFIX).exists():
+            raise CommandError('Rows of a previous run exist, delete the %s* users first' % PREFIX)
+
+        drivers, orders = self.seed(options['drivers'], options['orders'])
+        claims = dict((driver.id, []) for driver in drivers)
+
+        def run(driver):
+            try:
+                # every driver delivers as soon as it claims, then claims again
+                while True:
+                    order = dispatch.claim_next_order(driver, -34.92, 138.60)
+                    if order is None:
+                        return
+                    claims[driver.id].append(order.id)
+                    lifecycle.transition(order.id, Order.ONTHEWAY, Order.DELIVERED)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(driver,)) for driver in drivers]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        claimed = Counter(order_id for driver_claims in claims.values() for order_id in driver_claims)
+        double_claims = [order_id for order_id, count in claimed.items() if count > 1]
+        claimer = dict((order_id, driver_id) for driver_id, driver_claims in claims.items() for order_id in driver_claims)
+        mismatched = [
+            order_id for order_id, driver_id in Order.objects.filter(id__in=orders).values_list('id', 'driver_id')
+            if claimer.get(order_id) != driver_id
+        ]
+        unclaimed = Order.objects.filter(id__in=orders, status=Order.READY).count()
+
+        self.stdout.write('%d drivers claimed %d of %d orders in %.2f s, %.0f claims/s' % (
+            len(drivers), len(claimed), len(orders), elapsed, len(claimed) / elapsed))
+        self.stdout.write('double claims: %d, claims not matching the stored driver: %d, left unclaimed: %d' % (
+            len(double_claims), len(mismatched), unclaimed))
+
+        if not options['keep']:
+            User.objects.filter(username__startswith=PREFIX).delete()
+
+        if double_claims or mismatched or unclaimed:
+            raise CommandError('Order claiming is not safe')
+
+    def seed(self, driver_count, order_count):
+        owner = User.objects.create(username=PREFIX + 'restaurant')
+        restaurant = Restaurant.objects.create(user=owner, name='Bench', phone='0', address='Bench',
+                                               logo='restaurant_logo/bench.png',
+                                               latitude=-34.92, longitude=138.60)
+        customer = Customer.objects.create(user=User.objects.create(username=PREFIX + 'customer'))
+
+        User.objects.bulk_create([User(username='%sdriver-%d' % (PREFIX, i)) for i in range(driver_count)])
+        users = User.objects.filter(username__startswith=PREFIX + 'driver-')
+        Driver.objects.bulk_create([Driver(user=user) for user in users])
+        drivers = list(Driver.objects.filter(user__in=users))
+
+        Order.objects.bulk_create([
+            Order(customer=customer, restaurant=restaurant, address='Bench', total=10, status=Order.READY)
+            for _ in range(order_count)
+        ])
+        orders = list(Order.objects.filter(restaurant=restaurant).values_list('id', flat=True))
+        return drivers, orders
@@ -0,0 +1,105 @@
+import io
+import time
+from datetime import timedelta
+from wsgiref.util import setup_testing_defaults
+
+from django.contrib.auth.models import User
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+from oauth2_provider.models import AccessToken, Application
+
+from foodtaskerapp import dbpool
+from foodtaskerapp.loadtest import percentile
+from foodtaskerapp.models import Customer
+
+PREFIX = 'bench-connections-'
+
+
+class Command(BaseCommand):
+    help = ('Request a token authenticated endpoint through the WSGI handler, opening a database connection '
+            'per request and then reusing a persistent one, and compare the latencies. '
+            'Run it against the production database engine, SQLite connections are nearly free.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--path', default='/api/customer/order/latest/')
+
+    def handle(self, *args, **options):
+        token = self.seed()
+        conn_max_age = connection.settings_dict['CONN_MAX_AGE']
+        try:
+            handler = WSGIHandler()
+            with override_settings(ALLOWED_HOSTS=['localhost'], PROFILING_SAMPLE_RATE=0):
+                results = [
+                    ('per request', self.measure(handler, options['path'], token, options['requests'], 0)),
+                    ('persistent', self.measure(handler, options['path'], token, options['requests'], None)),
+                ]
+        finally:
+            connection.close()
+            connection.settings_dict['CONN_MAX_AGE'] = conn_max_age
+            self.clean()
+
+        for name, durations in results:
+            self.stdout.write('%-12s mean %7.2f ms, p50 %7.2f ms, p95 %7.2f ms, p99 %7.2f ms' % (
+                name, sum(durations) / len(durations) * 1000, percentile(durations, 0.50) * 1000,
+                percentile(durations, 0.95) * 1000, percentile(durations, 0.99) * 1000))
+        self.stdout.write(dbpool.stats.render())
+
+    def measure(self, handler, path, token, count, conn_max_age):
+        '''
+        :param conn_max_age: CONN_MAX_AGE for the run, None to keep connections open
+        :return: sorted request durations in seconds
+        '''
+        connection.close()
+        connection.settings_dict['CONN_MAX_AGE'] = conn_max_age
+        durations = []
+        # the first request opens the connection in both modes
+        for i in range(count + 1):
+            start = time.perf_counter()
+            status = self.request(handler, path, token)
+            elapsed = time.perf_counter() - start
+            if not status.startswith('200'):
+                raise RuntimeError('%s answered %s' % (path, status))
+            if i:
+                durations.append(elapsed)
+        return sorted(durations)
+
+    def request(self, handler, path, token):
+        environ = {
+            'PATH_INFO': path,
+            'QUERY_STRING': 'access_token=%s' % token,
+            'HTTP_HOST': 'localhost',
+            'wsgi.input': io.BytesIO(),
+        }
+        setup_testing_defaults(environ)
+        statuses = []
+        response = handler(environ, lambda status, headers, exc_info=None: statuses.append(status))
+        try:
+            b''.join(response)
+        finally:
+            # sends request_finished, which closes or keeps the connection
+            response.close()
+        return statuses[0]
+
+    def seed(self):
+        '''
+        A customer with an access token
+        :return: the token
+        '''
+        self.clean()
+        user = User.objects.create(username=PREFIX + 'customer')
+        Customer.objects.create(user=user, avatar='')
+        application = Application.objects.create(
+            name=PREFIX + 'app', user=user,
+            client_type=Application.CLIENT_CONFIDENTIAL, authorization_grant_type=Application.GRANT_PASSWORD
+        )
+        access_token = AccessToken.objects.create(user=user, application=application, token=PREFIX + 'token',
+                                                  scope='read write', expires=timezone.now() + timedelta(hours=1))
+        return access_token.token
+
+    def clean(self):
+        Application.objects.filter(name=PREFIX + 'app').delete()
+        User.objects.filter(username__startswith=PREFIX).delete()
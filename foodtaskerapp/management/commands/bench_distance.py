@@ -0,0 +1,63 @@
+import math
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from foodtaskerapp import distance
+
+
+def loop_haversine(point, coordinates):
+    '''
+    Per-row distance, the way Restaurant.get_distance used to compute it
+    with the haversine package
+    '''
+    latitude, longitude = point
+    results = []
+    for restaurant_latitude, restaurant_longitude in coordinates:
+        lat1, lng1, lat2, lng2 = map(math.radians, (latitude, longitude,
+                                                     float(restaurant_latitude), float(restaurant_longitude)))
+        a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+        results.append(2 * distance.EARTH_RADIUS * math.asin(math.sqrt(a)))
+    return results
+
+
+class Command(BaseCommand):
+    help = 'Compare the per-row haversine loop with the vectorized distance module'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000, 100000])
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        random.seed(0)
+        point = (-34.92, 138.60)
+
+        for size in options['sizes']:
+            coordinates = [
+                (Decimal('%.6f' % random.uniform(-35.2, -34.6)), Decimal('%.6f' % random.uniform(138.4, 138.9)))
+                for _ in range(size)
+            ]
+
+            loop_time = self.best_of(options['repeat'], loop_haversine, point, coordinates)
+            # packing happens once per query too, so it is part of the measured time
+            vector_time = self.best_of(options['repeat'],
+                                       lambda: distance.haversine(point, distance.pack(coordinates)))
+            packed = distance.pack(coordinates)
+            packed_time = self.best_of(options['repeat'], distance.haversine, point, packed)
+
+            self.stdout.write('%7d restaurants: loop %8.2f ms, vectorized %8.2f ms (%.1fx), pre-packed %8.2f ms (%.1fx)' % (
+                size,
+                loop_time * 1000,
+                vector_time * 1000, loop_time / vector_time,
+                packed_time * 1000, loop_time / packed_time,
+            ))
+
+    def best_of(self, repeat, function, *args):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function(*args)
+            timings.append(time.perf_counter() - start)
+        return min(timings)
@@ -0,0 +1,164 @@
+import random
+import time
+from datetime import timedelta
+from importlib import import_module
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from foodtaskerapp.models import Customer, Driver, Order, Restaurant
+
+PREFIX = 'bench-orders-'
+
+order_indexes = import_module('foodtaskerapp.migrations.0020_order_indexes')
+
+
+def drop_indexes():
+    '''
+    Leave the Order table with its FK indexes only, as before migration 0020
+    '''
+    with connection.schema_editor() as schema_editor:
+        schema_editor.alter_index_together(Order, Order._meta.index_together, [])
+        order_indexes.drop_partial_indexes(None, schema_editor)
+
+
+def create_indexes():
+    with connection.schema_editor() as schema_editor:
+        schema_editor.alter_index_together(Order, [], Order._meta.index_together)
+        order_indexes.create_partial_indexes(None, schema_editor)
+
+
+class Command(BaseCommand):
+    help = ('Seed a large order history and compare query plans and latencies of the hot Order queries '
+            'without and with the indexes of migration 0020. The seeded rows are reused by later runs.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=2000000)
+        parser.add_argument('--restaurants', type=int, default=200)
+        parser.add_argument('--customers', type=int, default=50000)
+        parser.add_argument('--drivers', type=int, default=2000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--clean', action='store_true', help='Delete the seeded rows and exit')
+
+    def handle(self, *args, **options):
+        if options['clean']:
+            Order.objects.filter(restaurant__user__username__startswith=PREFIX).delete()
+            User.objects.filter(username__startswith=PREFIX).delete()
+            return
+
+        random.seed(0)
+        if not User.objects.filter(username__startswith=PREFIX).exists():
+            self.seed(options)
+        restaurants = list(Restaurant.objects.filter(user__username__startswith=PREFIX).values_list('id', flat=True))
+        customers = list(Customer.objects.filter(user__username__startswith=PREFIX).values_list('id', flat=True))
+        drivers = list(Driver.objects.filter(user__username__startswith=PREFIX).values_list('id', flat=True))
+
+        queries = self.queries(restaurants, customers, drivers)
+
+        drop_indexes()
+        try:
+            before = self.run(queries, options['repeat'], 'without indexes')
+        finally:
+            create_indexes()
+        after = self.run(queries, options['repeat'], 'with indexes')
+
+        self.stdout.write('\n%-32s %12s %12s %8s' % ('query', 'before ms', 'after ms', 'speedup'))
+        for name, _ in queries:
+            self.stdout.write('%-32s %12.3f %12.3f %7.1fx' % (
+                name, before[name] * 1000, after[name] * 1000, before[name] / max(after[name], 1e-9)))
+
+    def queries(self, restaurants, customers, drivers):
+        '''
+        The Order lookups of apis.py, views.py, dispatch.py and reports.py
+        :return: list of (name, function returning a queryset)
+        '''
+        now = timezone.now()
+        return [
+            ('customer active order', lambda: Order.objects.filter(
+                customer_id=random.choice(customers)).exclude(status__in=[Order.DELIVERED, Order.PAYMENT_FAILED])),
+            ('customer en route driver', lambda: Order.objects.filter(
+                customer_id=random.choice(customers), status=Order.ONTHEWAY)),
+            ('driver active order', lambda: Order.objects.filter(
+                driver_id=random.choice(drivers), status=Order.ONTHEWAY)),
+            ('driver revenue this week', lambda: Order.objects.filter(
+                driver_id=random.choice(drivers), status=Order.DELIVERED, created_at__gte=now - timedelta(days=7))),
+            ('restaurant dashboard', lambda: Order.objects.filter(
+                restaurant_id=random.choice(restaurants)).order_by('-created_at')[:50]),
+            ('restaurant orders today', lambda: Order.objects.filter(
+                restaurant_id=random.choice(restaurants), created_at__gte=now - timedelta(days=1))),
+            ('ready orders nearby', lambda: Order.objects.filter(
+                status=Order.READY, driver=None,
+                restaurant_id__in=random.sample(restaurants, min(10, len(restaurants)))).order_by('created_at')[:50]),
+            ('delivered orders of a day', lambda: Order.objects.filter(
+                status=Order.DELIVERED, created_at__gte=now - timedelta(days=30), created_at__lt=now - timedelta(days=29))),
+        ]
+
+    def run(self, queries, repeat, label):
+        self.stdout.write('\n=== %s ===' % label)
+        timings = {}
+        with connection.cursor() as cursor:
+            for name, query in queries:
+                sql, params = query().query.sql_with_params()
+                self.stdout.write('\n%s\n%s' % (name, self.explain(cursor, sql, params)))
+
+                best = None
+                for _ in range(repeat):
+                    sql, params = query().query.sql_with_params()
+                    start = time.perf_counter()
+                    cursor.execute(sql, params)
+                    cursor.fetchall()
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                timings[name] = best
+        return timings
+
+    def explain(self, cursor, sql, params):
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return '\n'.join('  %s' % row[-1] for row in cursor.fetchall())
+        cursor.execute('EXPLAIN ' + sql, params)
+        return '\n'.join('  %s' % ' '.join(map(str, row)) for row in cursor.fetchall())
+
+    def seed(self, options):
+        self.stdout.write('Seeding %d orders...' % options['orders'])
+        User.objects.bulk_create(
+            [User(username='%srestaurant-%d' % (PREFIX, i)) for i in range(options['restaurants'])] +
+            [User(username='%scustomer-%d' % (PREFIX, i)) for i in range(options['customers'])] +
+            [User(username='%sdriver-%d' % (PREFIX, i)) for i in range(options['drivers'])]
+        )
+        Restaurant.objects.bulk_create([
+            Restaurant(user=user, name=user.username, phone='0', address='Bench', logo='restaurant_logo/bench.png',
+                       latitude=random.uniform(-35.2, -34.6), longitude=random.uniform(138.4, 138.9))
+            for user in User.objects.filter(username__startswith=PREFIX + 'restaurant-')
+        ])
+        Customer.objects.bulk_create([
+            Customer(user=user) for user in User.objects.filter(username__startswith=PREFIX + 'customer-')
+        ])
+        Driver.objects.bulk_create([
+            Driver(user=user) for user in User.objects.filter(username__startswith=PREFIX + 'driver-')
+        ])
+
+        restaurants = list(Restaurant.objects.filter(user__username__startswith=PREFIX).values_list('id', flat=True))
+        customers = list(Customer.objects.filter(user__username__startswith=PREFIX).values_list('id', flat=True))
+        drivers = list(Driver.objects.filter(user__username__startswith=PREFIX).values_list('id', flat=True))
+
+        # a year of history, almost all of it delivered, a few orders in flight
+        now = timezone.now()
+        in_flight = [Order.PREPARING, Order.READY, Order.ONTHEWAY]
+        batch = []
+        for i in range(options['orders']):
+            created_at = now - timedelta(seconds=random.randint(0, 365 * 24 * 60 * 60))
+            if created_at > now - timedelta(hours=1) and random.random() < 0.5:
+                status = random.choice(in_flight)
+            else:
+                status = Order.DELIVERED if random.random() < 0.98 else Order.PAYMENT_FAILED
+            driver_id = random.choice(drivers) if status in (Order.ONTHEWAY, Order.DELIVERED) else None
+            batch.append(Order(customer_id=random.choice(customers), restaurant_id=random.choice(restaurants),
+                               driver_id=driver_id, address='Bench', total=random.randint(5, 80),
+                               status=status, created_at=created_at))
+            if len(batch) == 10000:
+                Order.objects.bulk_create(batch)
+                batch = []
+        Order.objects.bulk_create(batch)
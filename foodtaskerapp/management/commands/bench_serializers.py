@@ -0,0 +1,106 @@
+import json
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.test import RequestFactory
+
+from foodtaskerapp import encoding
+from foodtaskerapp.models import Customer, Meal, Order, OrderDetails, Restaurant
+from foodtaskerapp.serializers import (MealSerializer, OrderSerializer, RestaurantSerializer, ORDER_VALUES,
+                                       fast_meals, fast_orders, fast_restaurants)
+
+PREFIX = 'bench-serializers-'
+
+
+class Command(BaseCommand):
+    help = ('Compare the DRF serializers with the .values() based fast serializers and the JSON encoders. '
+            'The rows are created in a transaction which is rolled back at the end.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000])
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        request = RequestFactory().get('/')
+        self.stdout.write('JSON encoder: %s' % ('ujson' if encoding.ujson is not None else 'json'))
+
+        for size in options['sizes']:
+            with transaction.atomic():
+                restaurant_ids = self.seed(size)
+                restaurants = Restaurant.objects.filter(id__in=restaurant_ids).order_by('-id')
+                meals = Meal.objects.filter(restaurant_id__in=restaurant_ids).order_by('-id')
+                orders = Order.objects.filter(restaurant_id__in=restaurant_ids).order_by('-id')
+
+                cases = [
+                    ('restaurants',
+                     lambda: RestaurantSerializer(restaurants, many=True, context={'request': request}).data,
+                     lambda: fast_restaurants(restaurants, request)),
+                    ('meals',
+                     lambda: MealSerializer(meals, many=True, context={'request': request}).data,
+                     lambda: fast_meals(meals, request)),
+                    ('orders',
+                     lambda: OrderSerializer(orders.with_details(), many=True).data,
+                     lambda: fast_orders(list(orders.values(*ORDER_VALUES)))),
+                ]
+                for name, slow, fast in cases:
+                    slow_time, slow_data = self.best_of(options['repeat'], slow)
+                    fast_time, fast_data = self.best_of(options['repeat'], fast)
+                    self.stdout.write('%6d %-12s DRF %9.1f ms, fast %9.1f ms (%.1fx)' % (
+                        size, name, slow_time * 1000, fast_time * 1000, slow_time / fast_time))
+
+                    document = {name: fast_data}
+                    json_time, json_data = self.best_of(options['repeat'],
+                                                        lambda: json.dumps(document, cls=DjangoJSONEncoder))
+                    dumps_time, dumps_data = self.best_of(options['repeat'], lambda: encoding.dumps(document))
+                    if json.loads(dumps_data.decode('utf-8')) != json.loads(json_data):
+                        raise CommandError('encoding.dumps and DjangoJSONEncoder disagree on the %s' % name)
+                    self.stdout.write('%6d %-12s JsonResponse encoder %9.1f ms, encoding.dumps %9.1f ms (%.1fx)' % (
+                        size, name, json_time * 1000, dumps_time * 1000, json_time / dumps_time))
+
+                transaction.set_rollback(True)
+
+    def best_of(self, repeat, function):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = function()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
+
+    def seed(self, size):
+        '''
+        size restaurants with one meal each and size orders
+        :return: ids of the restaurants
+        '''
+        User.objects.bulk_create([User(username='%s%d' % (PREFIX, i)) for i in range(size + 1)])
+        users = list(User.objects.filter(username__startswith=PREFIX).order_by('id'))
+        customer = Customer.objects.create(user=users.pop(), avatar='')
+
+        Restaurant.objects.bulk_create([
+            Restaurant(user=user, name='Restaurant %d' % i, phone='0', address='Bench', logo='restaurant_logo/bench.png',
+                       latitude=-34.92, longitude=138.60)
+            for i, user in enumerate(users)
+        ])
+        restaurant_ids = list(Restaurant.objects.filter(user__in=users).values_list('id', flat=True))
+
+        Meal.objects.bulk_create([
+            Meal(restaurant_id=restaurant_id, name='Meal', short_description='A meal', image='meal_images/bench.png',
+                 price=10)
+            for restaurant_id in restaurant_ids
+        ])
+        meals = dict(Meal.objects.filter(restaurant_id__in=restaurant_ids).values_list('restaurant_id', 'id'))
+
+        Order.objects.bulk_create([
+            Order(customer=customer, restaurant_id=restaurant_id, address='Bench', total=10, status=Order.READY)
+            for restaurant_id in restaurant_ids
+        ])
+        OrderDetails.objects.bulk_create([
+            OrderDetails(order_id=order_id, meal_id=meals[restaurant_id], quantity=1, sub_total=10)
+            for order_id, restaurant_id in Order.objects.filter(restaurant_id__in=restaurant_ids)
+                                                        .values_list('id', 'restaurant_id')
+        ])
+        return restaurant_ids
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from foodtaskerapp import images
+
+
+class Command(BaseCommand):
+    help = 'Generate the missing renditions of every meal image and restaurant logo'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Also check images which already have renditions')
+
+    def handle(self, *args, **options):
+        for kind, (model, image_field, hash_field) in sorted(images.IMAGE_FIELDS.items()):
+            instances = model.objects.exclude(**{image_field: ''})
+            if not options['all']:
+                instances = instances.filter(**{hash_field: ''})
+
+            done = failed = 0
+            for instance_id in instances.values_list('id', flat=True).iterator():
+                try:
+                    images.generate_renditions(kind, instance_id)
+                    done += 1
+                except (IOError, OSError) as error:
+                    failed += 1
+                    self.stderr.write('%s %s: %s' % (kind, instance_id, error))
+            self.stdout.write('%s: %d images done, %d failed' % (kind, done, failed))
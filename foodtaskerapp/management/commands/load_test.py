@@ -0,0 +1,67 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from foodtaskerapp import loadtest
+
+
+class Command(BaseCommand):
+    help = ('Run scripted customer, driver and restaurant scenarios in-process against the data of '
+            'seed_loadtest and report latency percentiles and query counts per endpoint. Payments go '
+            'through the stub gateway.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenarios', nargs='+', choices=sorted(loadtest.SCENARIOS),
+                            default=['browse', 'deliver', 'dashboard'])
+        parser.add_argument('--iterations', type=int, default=20, help='Runs of every scenario per thread')
+        parser.add_argument('--threads', type=int, default=1)
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--baseline', help='Fail if an endpoint got slower or runs more queries than in '
+                                               'this JSON file of an earlier run')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed p95 slowdown, default 20%%')
+
+    def handle(self, *args, **options):
+        if not loadtest.is_seeded():
+            raise CommandError('No load test data, run seed_loadtest first')
+
+        with override_settings(PAYMENT_GATEWAY='foodtaskerapp.payments.StubGateway',
+                               ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ['testserver']):
+            recorder = loadtest.run(options['scenarios'], options['iterations'], options['threads'])
+        results = recorder.summary()
+
+        self.stdout.write('%-30s %6s %6s %9s %9s %9s %8s %8s' % (
+            'endpoint', 'count', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'max'))
+        for label in sorted(results):
+            result = results[label]
+            self.stdout.write('%-30s %6d %6d %9.2f %9.2f %9.2f %8.1f %8d' % (
+                label, result['count'], result['errors'], result['p50'], result['p95'], result['p99'],
+                result['queries'], result['max_queries']))
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2, sort_keys=True)
+
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)
+            regressions = self.regressions(baseline, results, options['tolerance'])
+            for regression in regressions:
+                self.stderr.write(regression)
+            if regressions:
+                raise CommandError('%d endpoints regressed' % len(regressions))
+
+    def regressions(self, baseline, results, tolerance):
+        regressions = []
+        for label, result in sorted(results.items()):
+            before = baseline.get(label)
+            if before is None:
+                continue
+            if result['p95'] > before['p95'] * (1 + tolerance):
+                regressions.append('%s: p95 %.2f ms, was %.2f ms' % (label, result['p95'], before['p95']))
+            if result['max_queries'] > before['max_queries']:
+                regressions.append('%s: %d queries, was %d' % (label, result['max_queries'], before['max_queries']))
+            if result['errors'] > before['errors']:
+                regressions.append('%s: %d errors, was %d' % (label, result['errors'], before['errors']))
+        return regressions
@@ -0,0 +1,53 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from foodtaskerapp import dispatch, notifications, payments, tokens
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ('Periodically match available drivers with READY orders and publish the offers, '
+            'settle the orders whose payment job was lost and prune old notifications and token revocations')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=getattr(settings, 'DISPATCH_INTERVAL', 10))
+        parser.add_argument('--once', action='store_true', help='Run a single dispatch and exit')
+
+    def handle(self, *args, **options):
+        sweep_interval = getattr(settings, 'PAYMENT_SWEEP_INTERVAL', 60)
+        last_sweep = 0
+        while True:
+            start = time.time()
+            try:
+                offers = dispatch.dispatch()
+                if options['verbosity'] > 1:
+                    self.stdout.write('Published %d offers in %.3f s' % (offers, time.time() - start))
+            except Exception:
+                logger.exception('Dispatch failed')
+                connection.close()
+
+            if start - last_sweep >= sweep_interval:
+                last_sweep = start
+                try:
+                    settled = payments.sweep_pending_payments()
+                    if settled:
+                        logger.warning('Settled %d orders left waiting for their payment', settled)
+                except Exception:
+                    logger.exception('Payment sweep failed')
+                    connection.close()
+
+                try:
+                    notifications.prune()
+                    tokens.prune_revocations()
+                except Exception:
+                    logger.exception('Pruning failed')
+                    connection.close()
+
+            if options['once']:
+                return
+            time.sleep(max(0, options['interval'] - (time.time() - start)))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from foodtaskerapp import loadtest
+
+
+class Command(BaseCommand):
+    help = 'Generate restaurants, menus, customers, drivers and a delivered order history for load_test'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--restaurants', type=int, default=50)
+        parser.add_argument('--meals', type=int, default=20, help='Meals per restaurant')
+        parser.add_argument('--customers', type=int, default=1000)
+        parser.add_argument('--drivers', type=int, default=200)
+        parser.add_argument('--orders', type=int, default=20000)
+        parser.add_argument('--clean', action='store_true', help='Delete the generated rows and exit')
+
+    def handle(self, *args, **options):
+        if options['clean']:
+            loadtest.clean()
+            return
+        if loadtest.is_seeded():
+            raise CommandError('Load test data exists, run with --clean first')
+
+        loadtest.seed(restaurants=options['restaurants'], meals=options['meals'], customers=options['customers'],
+                      drivers=options['drivers'], orders=options['orders'])
+        self.stdout.write('Seeded %(restaurants)d restaurants, %(customers)d customers, %(drivers)d drivers '
+                          'and %(orders)d orders' % options)
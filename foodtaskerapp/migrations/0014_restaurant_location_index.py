@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodtaskerapp', '0013_usernotification'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='restaurant',
+            name='latitude',
+            field=models.DecimalField(blank=True, db_index=True, decimal_places=6, default=None, max_digits=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='restaurant',
+            name='longitude',
+            field=models.DecimalField(blank=True, db_index=True, decimal_places=6, default=None, max_digits=10, null=True),
+        ),
+    ]
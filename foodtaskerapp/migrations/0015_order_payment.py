@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import foodtaskerapp.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodtaskerapp', '0014_restaurant_location_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='charge_id',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='payment_key',
+            field=models.CharField(default=foodtaskerapp.models.new_payment_key, editable=False, max_length=32),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='status',
+            field=models.IntegerField(choices=[(0, 'Awaiting Payment'), (1, 'Preparing Order'), (2, 'Awaiting Driver'), (3, 'En Route'), (4, 'Delivered'), (5, 'Payment Failed')]),
+        ),
+    ]
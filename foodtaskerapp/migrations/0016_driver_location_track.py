@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodtaskerapp', '0015_order_payment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='driver',
+            name='latitude',
+            field=models.DecimalField(blank=True, decimal_places=6, default=None, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='driver',
+            name='longitude',
+            field=models.DecimalField(blank=True, decimal_places=6, default=None, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='driver',
+            name='location_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='DriverLocation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('latitude', models.DecimalField(decimal_places=6, max_digits=10)),
+                ('longitude', models.DecimalField(decimal_places=6, max_digits=10)),
+                ('recorded_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('driver', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='track', to='foodtaskerapp.Driver')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='track', to='foodtaskerapp.Order')),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodtaskerapp', '0018_cacheversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DispatchOffer',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('distance', models.FloatField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('driver', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='offer', to='foodtaskerapp.Driver')),
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='offer', to='foodtaskerapp.Order')),
+            ],
+        ),
+    ]
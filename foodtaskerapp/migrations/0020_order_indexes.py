@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# Partial indexes: only the few orders waiting for or with a driver are
+# indexed, so they stay small however long the order history grows.
+# PostgreSQL and SQLite support them, other databases skip them.
+PARTIAL_INDEXES = [
+    # READY orders without a driver, by restaurant and age (claiming, dispatch)
+    ('foodtaskerapp_order_ready_unassigned',
+     'foodtaskerapp_order (restaurant_id, created_at) WHERE status = 2 AND driver_id IS NULL'),
+    # the order a driver is delivering (active order checks, location tracking)
+    ('foodtaskerapp_order_on_the_way',
+     'foodtaskerapp_order (driver_id) WHERE status = 3'),
+]
+
+
+def supports_partial_indexes(schema_editor):
+    return schema_editor.connection.vendor in ('postgresql', 'sqlite')
+
+
+def create_partial_indexes(apps, schema_editor):
+    if supports_partial_indexes(schema_editor):
+        for name, definition in PARTIAL_INDEXES:
+            schema_editor.execute('CREATE INDEX %s ON %s' % (name, definition))
+
+
+def drop_partial_indexes(apps, schema_editor):
+    if supports_partial_indexes(schema_editor):
+        for name, definition in PARTIAL_INDEXES:
+            schema_editor.execute('DROP INDEX IF EXISTS %s' % name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodtaskerapp', '0019_dispatchoffer'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='order',
+            index_together=set([('customer', 'status'), ('driver', 'status', 'created_at'),
+                                ('restaurant', 'created_at'), ('status', 'created_at')]),
+        ),
+        migrations.RunPython(create_partial_indexes, drop_partial_indexes),
+    ]
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+PENDING_PAYMENT = 0
+ONTHEWAY = 3
+DELIVERED = 4
+PAYMENT_FAILED = 5
+
+
+def set_active_orders(apps, schema_editor):
+    Order = apps.get_model('foodtaskerapp', 'Order')
+    Customer = apps.get_model('foodtaskerapp', 'Customer')
+    Driver = apps.get_model('foodtaskerapp', 'Driver')
+
+    active = Order.objects.exclude(status__in=[DELIVERED, PAYMENT_FAILED]).order_by('id')
+    for order_id, customer_id in active.values_list('id', 'customer_id'):
+        Customer.objects.filter(id=customer_id).update(active_order=order_id)
+    for order_id, driver_id in active.filter(status=ONTHEWAY).values_list('id', 'driver_id'):
+        Driver.objects.filter(id=driver_id).update(active_order=order_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodtaskerapp', '0020_order_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='paid_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='ready_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='delivered_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='active_order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='foodtaskerapp.Order'),
+        ),
+        migrations.AddField(
+            model_name='driver',
+            name='active_order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='foodtaskerapp.Order'),
+        ),
+        migrations.RunPython(set_active_orders, migrations.RunPython.noop),
+    ]
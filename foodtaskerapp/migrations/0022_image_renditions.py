@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodtaskerapp', '0021_order_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='meal',
+            name='image_hash',
+            field=models.CharField(blank=True, editable=False, max_length=16),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='logo_hash',
+            field=models.CharField(blank=True, editable=False, max_length=16),
+        ),
+    ]
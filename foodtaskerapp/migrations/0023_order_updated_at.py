@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def set_updated_at(apps, schema_editor):
+    Order = apps.get_model('foodtaskerapp', 'Order')
+    Order.objects.update(updated_at=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodtaskerapp', '0022_image_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(set_updated_at, migrations.RunPython.noop),
+        migrations.AlterIndexTogether(
+            name='order',
+            index_together=set([('customer', 'status'), ('driver', 'status', 'created_at'),
+                                ('restaurant', 'created_at'), ('status', 'created_at'),
+                                ('restaurant', 'updated_at')]),
+        ),
+    ]
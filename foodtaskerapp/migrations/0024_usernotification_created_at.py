@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodtaskerapp', '0023_order_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usernotification',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterIndexTogether(
+            name='usernotification',
+            index_together=set([('user', 'created_at')]),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodtaskerapp', '0024_usernotification_created_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='payment_source',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+    ]
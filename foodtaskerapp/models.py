@@ -2,31 +2,64 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 from datetime import datetime
+import uuid
 
 # Create your models here.
+def local_now():
+    return timezone.now().astimezone(timezone.get_default_timezone())
+
+
+class RestaurantQuerySet(models.QuerySet):
+    def open_at(self, moment):
+        '''
+        Restaurants taking orders at the given local time of day. Opening
+        hours may wrap past midnight, e.g. 18:00 to 02:00.
+        '''
+        no_hours = models.Q(opening_time__isnull=True) | models.Q(closing_time__isnull=True)
+        same_day = models.Q(opening_time__lt=models.F('closing_time'), opening_time__lte=moment, closing_time__gt=moment)
+        overnight = models.Q(opening_time__gt=models.F('closing_time')) & \
+                    (models.Q(opening_time__lte=moment) | models.Q(closing_time__gt=moment))
+        return self.filter(no_hours | same_day | overnight, is_open_for_orders=True)
+
+    def open_now(self):
+        return self.open_at(local_now().time())
+
+
 class Restaurant(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='restaurant')
     name = models.CharField(max_length=500)
     phone = models.CharField(max_length=500)
     address = models.CharField(max_length=500)
     logo = models.ImageField(upload_to='restaurant_logo/', blank=False)
+    # content hash in the names of the logo's renditions, see foodtaskerapp.images
+    logo_hash = models.CharField(max_length=16, blank=True, editable=False)
     opening_time = models.TimeField(null=True, blank=True)
     closing_time = models.TimeField(null=True, blank=True)
-    latitude = models.DecimalField(max_digits=10, decimal_places=6, null=True, blank=True, default=None)
-    longitude = models.DecimalField(max_digits=10, decimal_places=6, null=True, blank=True, default=None)
+    latitude = models.DecimalField(max_digits=10, decimal_places=6, null=True, blank=True, default=None, db_index=True)
+    longitude = models.DecimalField(max_digits=10, decimal_places=6, null=True, blank=True, default=None, db_index=True)
     is_open_for_orders = models.BooleanField(default=True)
 
+    objects = RestaurantQuerySet.as_manager()
 
     def __str__(self):
         return self.name
 
-    def is_open(self):
-        now = timezone.now().astimezone(timezone.get_default_timezone())
-        is_open = True
-        if self.opening_time and self.closing_time:
-            is_open = (self.opening_time <= now.time() < self.closing_time)
-        print(is_open, self.is_open_for_orders)
-        return is_open and self.is_open_for_orders
+    def is_open(self, moment=None):
+        '''
+        Same rules as Restaurant.objects.open_at()
+        :param moment: local time of day, default now
+        '''
+        if moment is None:
+            moment = local_now().time()
+        return self.is_open_for_orders and self.hours_include(self.opening_time, self.closing_time, moment)
+
+    @staticmethod
+    def hours_include(opening_time, closing_time, moment):
+        if not (opening_time and closing_time):
+            return True
+        if opening_time <= closing_time:
+            return opening_time <= moment < closing_time
+        return moment >= opening_time or moment < closing_time
 
     def get_distance(self, latitude, longitude):
         '''
@@ -36,17 +69,52 @@ class Restaurant(models.Model):
         :param longitude: Longitude of the point
         :return: distance in kms
         '''
-        from haversine import haversine
+        from foodtaskerapp.distance import haversine
         if self.longitude and self.latitude:
-            return haversine((latitude, longitude), (self.latitude, self.longitude))
+            return float(haversine((latitude, longitude), [(self.latitude, self.longitude)])[0])
         else:
             return None
 
+class CacheVersion(models.Model):
+    '''
+    Version counters of cached documents, shared by all processes. Bumping
+    one invalidates every copy of the document built from an older version.
+    '''
+    key = models.CharField(max_length=100, unique=True)
+    version = models.IntegerField(default=0)
+
+    @classmethod
+    def get(cls, key):
+        return cls.objects.filter(key=key).values_list('version', flat=True).first() or 0
+
+    @classmethod
+    def bump(cls, key):
+        if not cls.objects.filter(key=key).update(version=models.F('version') + 1):
+            cls.objects.get_or_create(key=key, defaults={'version': 1})
+
+    def __str__(self):
+        return '%s@%s' % (self.key, self.version)
+
+
+class RevokedToken(models.Model):
+    '''
+    Access tokens revoked or changed while they could still be cached,
+    see foodtaskerapp.tokens
+    '''
+    token = models.CharField(max_length=255, db_index=True)
+    revoked_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return self.token
+
+
 class Customer(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='customer')
     avatar = models.CharField(max_length=500)
     phone = models.CharField(max_length=500, blank=True)
     address = models.CharField(max_length=500, blank=True)
+    # Order placed and not yet delivered, kept by foodtaskerapp.lifecycle
+    active_order = models.ForeignKey('Order', blank=True, null=True, on_delete=models.SET_NULL, related_name='+')
 
     def __str__(self):
         return self.user.get_full_name()
@@ -54,6 +122,10 @@ class Customer(models.Model):
 class UserNotification(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
     notification = models.TextField(blank=True, null=True, default=None)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        index_together = (('user', 'created_at'),)
 
 
 class Driver(models.Model):
@@ -62,6 +134,11 @@ class Driver(models.Model):
     phone = models.CharField(max_length=500, blank=True)
     address = models.CharField(max_length=500, blank=True)
     location = models.CharField(max_length=500, blank=True)
+    latitude = models.DecimalField(max_digits=10, decimal_places=6, null=True, blank=True, default=None)
+    longitude = models.DecimalField(max_digits=10, decimal_places=6, null=True, blank=True, default=None)
+    location_updated_at = models.DateTimeField(blank=True, null=True)
+    # Order on the way, kept by foodtaskerapp.lifecycle
+    active_order = models.ForeignKey('Order', blank=True, null=True, on_delete=models.SET_NULL, related_name='+')
 
     def __str__(self):
         return self.user.get_full_name()
@@ -88,6 +165,8 @@ class Meal(models.Model):
     name = models.CharField(max_length=500)
     short_description = models.CharField(max_length=500)
     image = models.ImageField(upload_to='meal_images/', blank=False)
+    # content hash in the names of the image's renditions, see foodtaskerapp.images
+    image_hash = models.CharField(max_length=16, blank=True, editable=False)
     price = models.DecimalField(default=0, decimal_places=2, max_digits=10)
     category = models.ForeignKey(MealCategory, null=True, blank=True, default=None)
     is_available = models.BooleanField(default=True)
@@ -97,17 +176,35 @@ class Meal(models.Model):
         return self.name
 
 
+class OrderQuerySet(models.QuerySet):
+    def with_details(self):
+        '''
+        Load everything OrderSerializer and the order dashboard read, so a
+        list of orders costs the same number of queries as a single one
+        '''
+        return self.select_related('customer__user', 'driver__user', 'restaurant')\
+                   .prefetch_related('order_details__meal')
+
+
+def new_payment_key():
+    return uuid.uuid4().hex
+
+
 class Order(models.Model):
+    PENDING_PAYMENT = 0
     PREPARING = 1
     READY = 2
     ONTHEWAY = 3
     DELIVERED = 4
+    PAYMENT_FAILED = 5
 
     STATUS_CHOICES = (
+    (PENDING_PAYMENT, "Awaiting Payment"),
     (PREPARING, "Preparing Order"),
     (READY, "Awaiting Driver"),
     (ONTHEWAY, "En Route"),
-    (DELIVERED, "Delivered")
+    (DELIVERED, "Delivered"),
+    (PAYMENT_FAILED, "Payment Failed")
     )
 
     customer = models.ForeignKey(Customer)
@@ -117,8 +214,29 @@ class Order(models.Model):
     total = models.DecimalField(decimal_places=2, max_digits=10)
     status = models.IntegerField(choices = STATUS_CHOICES)
     created_at = models.DateTimeField(default = timezone.now)
+    paid_at = models.DateTimeField(blank = True, null = True)
+    ready_at = models.DateTimeField(blank = True, null = True)
     picked_at = models.DateTimeField(blank = True, null = True)
+    delivered_at = models.DateTimeField(blank = True, null = True)
+    # queryset update()s bypass auto_now and must set it themselves
+    updated_at = models.DateTimeField(auto_now = True)
     extra_notes = models.TextField(blank=True, null=True)
+    payment_key = models.CharField(max_length=32, default=new_payment_key, editable=False)
+    charge_id = models.CharField(max_length=255, blank=True)
+    # card token until the charge is settled, so a stale payment can be retried
+    payment_source = models.CharField(max_length=255, blank=True, editable=False)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        # see migration 0020 for the partial indexes of READY and ONTHEWAY orders
+        index_together = (
+            ('customer', 'status'),
+            ('driver', 'status', 'created_at'),
+            ('restaurant', 'created_at'),
+            ('status', 'created_at'),
+            ('restaurant', 'updated_at'),
+        )
 
     def __str__(self):
         return str(self.id)
@@ -131,3 +249,48 @@ class OrderDetails(models.Model):
 
     def __str__(self):
         return str(self.id)
+
+
+class DriverLocation(models.Model):
+    driver = models.ForeignKey(Driver, related_name='track')
+    order = models.ForeignKey(Order, related_name='track')
+    latitude = models.DecimalField(max_digits=10, decimal_places=6)
+    longitude = models.DecimalField(max_digits=10, decimal_places=6)
+    recorded_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return '%s,%s' % (self.latitude, self.longitude)
+
+
+class DailySales(models.Model):
+    '''
+    Sales of delivered orders per restaurant and day. Rows with a meal hold
+    the quantity and revenue of that meal, rows without one hold the number
+    of orders and their total revenue. Keys may repeat, always sum them.
+    '''
+    restaurant = models.ForeignKey(Restaurant)
+    day = models.DateField()
+    meal = models.ForeignKey(Meal, blank=True, null=True)
+    driver = models.ForeignKey(Driver, blank=True, null=True)
+    revenue = models.DecimalField(default=0, decimal_places=2, max_digits=12)
+    quantity = models.IntegerField(default=0)
+    orders = models.IntegerField(default=0)
+
+    class Meta:
+        index_together = (('restaurant', 'day'),)
+
+    def __str__(self):
+        return '%s %s' % (self.restaurant, self.day)
+
+
+class DispatchOffer(models.Model):
+    '''
+    Order the dispatch engine currently proposes to a driver
+    '''
+    driver = models.OneToOneField(Driver, on_delete=models.CASCADE, related_name='offer')
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name='offer')
+    distance = models.FloatField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return '%s -> %s' % (self.order_id, self.driver_id)
@@ -0,0 +1,281 @@
+import json
+import logging
+import threading
+import time
+from collections import Counter, deque
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.dispatch import receiver
+from django.utils import timezone
+
+from foodtaskerapp.models import Order, UserNotification
+from foodtaskerapp.signals import order_status_changed
+
+# Seconds a replay or poll reaches back before its watermark, and most events sent per replay
+REPLAY_OVERLAP = 5
+REPLAY_LIMIT = 100
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationHub(object):
+    '''
+    In-process fan-out of events to the stream clients waiting on them.
+    The last few events of every connected user are kept in memory, so
+    waking clients never have to query the database for them. Events are
+    numbered in the order this process published them, the numbers mean
+    nothing elsewhere.
+    '''
+
+    def __init__(self, backlog_size=50):
+        self.condition = threading.Condition()
+        self.backlog_size = backlog_size
+        self.events = {}
+        self.clients = Counter()
+        self.sequence = 0
+        # every event stamped before it was published, see NotificationPoller
+        self.watermark = None
+
+    def subscribe(self, user_id):
+        with self.condition:
+            self.clients[user_id] += 1
+
+    def unsubscribe(self, user_id):
+        with self.condition:
+            self.clients[user_id] -= 1
+            if self.clients[user_id] <= 0:
+                del self.clients[user_id]
+                self.events.pop(user_id, None)
+
+    def users(self):
+        with self.condition:
+            return list(self.clients)
+
+    def publish(self, events, watermark):
+        '''
+        :param events: list of (user_id, event_id, created_at, data) tuples
+        :param watermark: time before which every event was published
+        '''
+        with self.condition:
+            for user_id, event_id, created_at, data in events:
+                if user_id not in self.clients:
+                    continue
+                self.sequence += 1
+                backlog = self.events.setdefault(user_id, deque(maxlen=self.backlog_size))
+                backlog.append((self.sequence, event_id, created_at, data))
+            self.watermark = watermark
+            self.condition.notify_all()
+
+    def cursor(self):
+        with self.condition:
+            return self.sequence
+
+    def wait(self, user_id, cursor, timeout):
+        '''
+        Block until there are events published after cursor, or timeout
+        :return: (new cursor, list of (event_id, created_at, data) tuples,
+                  possibly empty, and the watermark they were published up to)
+        '''
+        with self.condition:
+            self.condition.wait_for(lambda: self._events_after(user_id, cursor), timeout)
+            events = [event[1:] for event in self._events_after(user_id, cursor)]
+            return self.sequence, events, self.watermark
+
+    def _events_after(self, user_id, cursor):
+        return [event for event in self.events.get(user_id, ()) if event[0] > cursor]
+
+
+hub = NotificationHub()
+
+
+class NotificationPoller(object):
+    '''
+    Feeds the hub of this process with the notifications written by every
+    process, with one query every NOTIFICATION_POLL_INTERVAL seconds for all
+    the connected users together. Notifications are stamped before their
+    transaction commits, so each poll goes back REPLAY_OVERLAP seconds and
+    skips the ones already published.
+    '''
+
+    def __init__(self, hub):
+        self.hub = hub
+        self.thread = None
+        self.lock = threading.Lock()
+        self.published = {}
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self.run, name='notification-poller')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def run(self):
+        interval = getattr(settings, 'NOTIFICATION_POLL_INTERVAL', 1)
+        since = timezone.now()
+        while True:
+            time.sleep(interval)
+            try:
+                since = self.poll(since)
+            except Exception:
+                logger.exception('Could not read notifications')
+                connection.close()
+
+    def poll(self, since):
+        '''
+        Publish the notifications of the connected users created after since
+        :return: the watermark of the next poll
+        '''
+        watermark = timezone.now()
+        users = self.hub.users()
+        rows = []
+        if users:
+            rows = UserNotification.objects.filter(
+                user_id__in=users, created_at__gt=since - timedelta(seconds=REPLAY_OVERLAP)
+            ).order_by('created_at', 'id').values_list('user_id', 'id', 'created_at', 'notification')
+
+        events = [row for row in rows if row[1] not in self.published]
+        for user_id, event_id, created_at, data in events:
+            self.published[event_id] = created_at
+        horizon = watermark - timedelta(seconds=REPLAY_OVERLAP)
+        self.published = dict((event_id, created_at) for event_id, created_at in self.published.items()
+                              if created_at > horizon)
+
+        self.hub.publish(events, watermark)
+        return watermark
+
+
+poller = NotificationPoller(hub)
+
+_streams = threading.BoundedSemaphore(getattr(settings, 'NOTIFICATION_STREAM_MAX_CLIENTS', 4))
+
+
+def publish_order(order, event):
+    '''
+    Store an order event for the restaurant, the pollers of the processes
+    serving its streams push it to them
+    :param order: Order the event is about
+    :param event: "new_order" or "status_changed"
+    '''
+    data = json.dumps({
+        "event": event,
+        "order_id": order.id,
+        "status": order.status,
+        "status_display": order.get_status_display(),
+    })
+    UserNotification.objects.create(user_id=order.restaurant.user_id, notification=data)
+
+
+def prune():
+    '''
+    Delete the notifications too old to be replayed to reconnecting streams
+    :return: number of notifications deleted
+    '''
+    max_age = getattr(settings, 'NOTIFICATION_STREAM_MAX_AGE', 300)
+    retention = getattr(settings, 'NOTIFICATION_RETENTION', max_age * 2)
+    deleted, per_model = UserNotification.objects.filter(
+        created_at__lt=timezone.now() - timedelta(seconds=retention)
+    ).delete()
+    return deleted
+
+
+class Stream(object):
+    '''
+    The events of stream(), holding one of the stream slots of this process
+    until the response is closed
+    '''
+
+    def __init__(self, user, since=None):
+        self.events = stream(user, since)
+        self.closed = False
+
+    def __iter__(self):
+        return self.events
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.events.close()
+            _streams.release()
+
+
+def open_stream(user, since=None):
+    '''
+    Every open stream keeps a server thread busy, at most
+    NOTIFICATION_STREAM_MAX_CLIENTS are served by each process.
+    :return: a Stream, None if all the slots of this process are taken
+    '''
+    if not _streams.acquire(blocking=False):
+        return None
+    poller.start()
+    return Stream(user, since)
+
+
+def replay(user, since):
+    '''
+    Notifications of a reconnecting stream, from REPLAY_OVERLAP seconds
+    before the since watermark
+    '''
+    return list(UserNotification.objects.filter(user=user, created_at__gt=since - timedelta(seconds=REPLAY_OVERLAP))
+                                        .order_by('created_at', 'id')
+                                        .values_list('id', 'created_at', 'notification')[:REPLAY_LIMIT])
+
+
+def stream(user, since=None):
+    '''
+    Generate server-sent events for a user, starting after the since
+    watermark. Event ids are watermarks: the stream ends after
+    NOTIFICATION_STREAM_MAX_AGE seconds, and browsers reconnect with the
+    last one in the Last-Event-ID header to pick up where they left off.
+    Only reconnects read the database, live events come from the hub.
+    Browsers may see an event twice across a reconnect.
+    '''
+    heartbeat = getattr(settings, 'NOTIFICATION_STREAM_HEARTBEAT', 15)
+    max_age = getattr(settings, 'NOTIFICATION_STREAM_MAX_AGE', 300)
+    sent = deque(maxlen=REPLAY_LIMIT)
+
+    yield 'retry: 3000\n\n'
+    hub.subscribe(user.id)
+    try:
+        # taken before reading, the overlap with the replay is skipped below
+        cursor = hub.cursor()
+        watermark = since
+        events = replay(user, since) if since is not None else []
+        # waiting streams do not hold on to a database connection
+        connection.close()
+
+        deadline = time.time() + max_age
+        while True:
+            for event_id, created_at, data in events:
+                if event_id not in sent:
+                    sent.append(event_id)
+                    watermark = created_at if watermark is None else max(watermark, created_at)
+                    yield 'id: %s\ndata: %s\n\n' % (watermark.isoformat(), data)
+            if time.time() >= deadline:
+                return
+
+            cursor, events, published = hub.wait(user.id, cursor, heartbeat)
+            if not events:
+                if published is not None and (watermark is None or published > watermark):
+                    watermark = published
+                if watermark is None:
+                    yield ': keepalive\n\n'
+                else:
+                    yield 'id: %s\n: keepalive\n\n' % watermark.isoformat()
+    finally:
+        hub.unsubscribe(user.id)
+
+
+@receiver(order_status_changed, dispatch_uid='notifications_order_status_changed')
+def publish_order_event(sender, order, previous_status, **kwargs):
+    # the restaurant only sees orders once they are paid
+    if order.status in (Order.PENDING_PAYMENT, Order.PAYMENT_FAILED):
+        return
+
+    if previous_status in (None, Order.PENDING_PAYMENT):
+        publish_order(order, "new_order")
+    else:
+        publish_order(order, "status_changed")
@@ -0,0 +1,104 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def is_paginated(request):
+    '''
+    Lists are only paginated for clients asking for pages, released apps
+    which do not know about next_cursor still get the whole list
+    '''
+    return "cursor" in request.GET or "page_size" in request.GET
+
+
+class CursorPagination(object):
+    '''
+    Keyset pagination over a unique integer field. The cursor handed to the
+    client is opaque, and every page costs the same however deep it is.
+
+        pagination = CursorPagination(request, ordering="-id")
+        orders, next_cursor = pagination.paginate(Order.objects.filter(...))
+
+    Reads the "cursor" and "page_size" query parameters. next_cursor is None
+    on the last page.
+    '''
+
+    def __init__(self, request, ordering="-id", page_size=None):
+        self.ordering = ordering
+        self.field = ordering.lstrip("-")
+        self.descending = ordering.startswith("-")
+
+        max_page_size = getattr(settings, 'PAGINATION_MAX_PAGE_SIZE', 100)
+        if page_size is None:
+            page_size = getattr(settings, 'PAGINATION_PAGE_SIZE', 20)
+        try:
+            page_size = int(request.GET.get("page_size", page_size))
+        except ValueError:
+            raise InvalidCursor("page_size must be a number")
+        self.page_size = max(1, min(page_size, max_page_size))
+
+        self.position = self.decode(request.GET.get("cursor"))
+
+    def decode(self, cursor):
+        if not cursor:
+            return None
+        try:
+            padded = cursor + "=" * (-len(cursor) % 4)
+            data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+            position = int(data[self.field])
+        except (binascii.Error, UnicodeError, ValueError, KeyError, TypeError):
+            raise InvalidCursor("Invalid cursor")
+        return position
+
+    def encode(self, position):
+        data = json.dumps({self.field: position}, separators=(",", ":"))
+        return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii").rstrip("=")
+
+    def is_after_cursor(self, position):
+        if self.position is None:
+            return True
+        return position < self.position if self.descending else position > self.position
+
+    def filter(self, queryset):
+        '''
+        Order the queryset and skip everything up to the cursor
+        '''
+        if self.position is not None:
+            lookup = "%s__%s" % (self.field, "lt" if self.descending else "gt")
+            queryset = queryset.filter(**{lookup: self.position})
+        return queryset.order_by(self.ordering)
+
+    def page(self, items, key=None):
+        '''
+        Take a page from items, which must already be in order and after the cursor
+        :param key: returns the ordering value of an item, default its attribute
+        :return: (list of items, next cursor or None)
+        '''
+        if key is None:
+            key = lambda item: getattr(item, self.field)
+
+        results = []
+        for item in items:
+            if len(results) == self.page_size:
+                return results, self.encode(key(results[-1]))
+            results.append(item)
+        return results, None
+
+    def paginate(self, queryset, key=None):
+        '''
+        :param key: see page(), needed for .values() querysets
+        :return: (list of objects, next cursor or None)
+        '''
+        return self.page(self.filter(queryset)[:self.page_size + 1], key)
+
+    def paginate_list(self, items, key):
+        '''
+        Page through an in-memory list, already sorted by the ordering field
+        '''
+        return self.page((item for item in items if self.is_after_cursor(key(item))), key)
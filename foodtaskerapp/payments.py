@@ -0,0 +1,154 @@
+import logging
+import time
+import uuid
+from datetime import timedelta
+
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from foodtaskerapp import lifecycle, workers
+from foodtaskerapp.models import Order
+
+logger = logging.getLogger(__name__)
+
+stripe.api_key = settings.STRIPE_API_KEY
+
+
+class PaymentDeclined(Exception):
+    '''
+    The gateway refused the charge, retrying will not help
+    '''
+
+
+class PaymentUnavailable(Exception):
+    '''
+    The gateway could not be reached or failed, the charge may be retried
+    '''
+
+
+class StripeGateway(object):
+    def charge(self, amount, source, description, idempotency_key):
+        '''
+        Charge amount (in cents) to the card behind source
+        :return: id of the charge
+        '''
+        try:
+            charge = stripe.Charge.create(
+                amount = amount,
+                currency = "aud",
+                source = source,
+                description = description,
+                idempotency_key = idempotency_key
+            )
+        except stripe.error.CardError as error:
+            raise PaymentDeclined(str(error))
+        except (stripe.error.APIConnectionError, stripe.error.RateLimitError, stripe.error.APIError) as error:
+            raise PaymentUnavailable(str(error))
+        except stripe.error.StripeError as error:
+            # e.g. a reused token or a bad API key, retrying will not help
+            raise PaymentDeclined(str(error))
+
+        if charge.status == "failed":
+            raise PaymentDeclined(charge.failure_message or "Charge failed")
+        return charge.id
+
+
+class StubGateway(object):
+    '''
+    Local stand-in for the payment gateway, for development and tests.
+    Source "tok_declined" is declined, "tok_unavailable" always fails to
+    connect and "tok_flaky" fails to connect on the first attempt only.
+    Charges are remembered per idempotency key, like the real gateway does.
+    '''
+    charges = {}
+    attempts = {}
+
+    def charge(self, amount, source, description, idempotency_key):
+        if idempotency_key in self.charges:
+            return self.charges[idempotency_key]
+
+        self.attempts[idempotency_key] = self.attempts.get(idempotency_key, 0) + 1
+        if source == "tok_declined":
+            raise PaymentDeclined("Your card was declined.")
+        if source == "tok_unavailable" or (source == "tok_flaky" and self.attempts[idempotency_key] == 1):
+            raise PaymentUnavailable("Could not connect to the payment gateway.")
+
+        self.charges[idempotency_key] = "ch_stub_%s" % uuid.uuid4().hex
+        return self.charges[idempotency_key]
+
+
+def get_gateway():
+    return import_string(getattr(settings, 'PAYMENT_GATEWAY', 'foodtaskerapp.payments.StripeGateway'))()
+
+
+def enqueue_charge(order):
+    '''
+    Charge a PENDING_PAYMENT order in the background once the current
+    transaction commits. Orders whose job is lost, e.g. to a restart, are
+    picked up by sweep_pending_payments().
+    '''
+    transaction.on_commit(lambda: workers.submit('payments', charge_order, order.id))
+
+
+def charge_order(order_id, max_retries=None):
+    '''
+    Charge the order and move it to PREPARING, or PAYMENT_FAILED if the
+    charge is declined or the gateway stays unavailable. Retries reuse the
+    order's idempotency key so the customer can never be charged twice.
+    :param max_retries: attempts after the first one, default PAYMENT_MAX_RETRIES
+    :return: True if the order was paid, None if it was no longer pending
+    '''
+    order = Order.objects.filter(id = order_id, status = Order.PENDING_PAYMENT).first()
+    if order is None:
+        return None
+    gateway = get_gateway()
+    if max_retries is None:
+        max_retries = getattr(settings, 'PAYMENT_MAX_RETRIES', 3)
+
+    attempt = 0
+    while order.payment_source:
+        try:
+            charge_id = gateway.charge(
+                amount = int(order.total) * 100, # Amount in Cents
+                source = order.payment_source,
+                description = "B!te Order",
+                idempotency_key = order.payment_key
+            )
+        except PaymentDeclined as error:
+            logger.info('Payment for order %s declined: %s', order.id, error)
+            break
+        except PaymentUnavailable as error:
+            attempt += 1
+            if attempt > max_retries:
+                logger.error('Payment for order %s failed after %s attempts: %s', order.id, attempt, error)
+                break
+            time.sleep(2 ** attempt)
+            continue
+
+        lifecycle.transition(order.id, Order.PENDING_PAYMENT, Order.PREPARING,
+                             charge_id = charge_id, payment_source = "")
+        return True
+
+    lifecycle.transition(order.id, Order.PENDING_PAYMENT, Order.PAYMENT_FAILED, payment_source = "")
+    return False
+
+
+def sweep_pending_payments():
+    '''
+    Settle the orders still waiting for their payment PAYMENT_SWEEP_AFTER
+    seconds after they were placed, their background job was lost. They are
+    charged once more with the same idempotency key, so a charge which went
+    through before is found again instead of being made twice.
+    :return: number of orders settled
+    '''
+    stale = timezone.now() - timedelta(seconds = getattr(settings, 'PAYMENT_SWEEP_AFTER', 600))
+    order_ids = list(Order.objects.filter(status = Order.PENDING_PAYMENT, created_at__lt = stale)
+                                  .order_by('created_at').values_list('id', flat = True)[:100])
+    settled = 0
+    for order_id in order_ids:
+        if charge_order(order_id, max_retries = 0) is not None:
+            settled += 1
+    return settled
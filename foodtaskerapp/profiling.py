@@ -0,0 +1,212 @@
+import cProfile
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.db import connection
+from django.http import Http404, HttpResponse
+from django.utils.crypto import constant_time_compare
+
+from foodtaskerapp import dbpool
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# Duplicate statements kept per view
+TOP_DUPLICATES = 5
+
+_literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_lists = re.compile(r'\((?:\?, )+\?\)')
+
+
+def normalize_sql(sql):
+    '''
+    Replace the literals of a logged statement, so the same query with other
+    parameters counts as a duplicate
+    '''
+    return _lists.sub('(...)', _literals.sub('?', sql))
+
+
+class Histogram(object):
+    '''
+    Cumulative histogram in the Prometheus sense: counts[i] is the number
+    of observations <= buckets[i]. Not thread safe, Metrics locks around it.
+    '''
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+class ViewMetrics(object):
+    def __init__(self):
+        self.duration = Histogram(DURATION_BUCKETS)
+        self.queries = Histogram(QUERY_COUNT_BUCKETS)
+        self.query_duration = Histogram(DURATION_BUCKETS)
+        self.response_size = Histogram(SIZE_BUCKETS)
+        self.duplicates = Counter()
+
+
+class Metrics(object):
+    '''
+    Per-view request metrics of this process. Every gunicorn worker keeps
+    its own, so each scrape reports the worker that answered it.
+    '''
+
+    def __init__(self):
+        self.views = OrderedDict()
+        self.lock = threading.Lock()
+
+    def record(self, view, duration, queries, response_size):
+        '''
+        :param queries: list of (sql, seconds) the request ran
+        '''
+        statements = Counter(normalize_sql(sql) for sql, seconds in queries)
+        with self.lock:
+            metrics = self.views.get(view)
+            if metrics is None:
+                metrics = self.views[view] = ViewMetrics()
+            metrics.duration.observe(duration)
+            metrics.queries.observe(len(queries))
+            metrics.query_duration.observe(sum(seconds for sql, seconds in queries))
+            metrics.response_size.observe(response_size)
+            for sql, count in statements.items():
+                if count > 1:
+                    metrics.duplicates[sql] += count - 1
+            # only the worst offenders are kept, or the counter grows with every id
+            if len(metrics.duplicates) > 10 * TOP_DUPLICATES:
+                metrics.duplicates = Counter(dict(metrics.duplicates.most_common(TOP_DUPLICATES)))
+
+    def clear(self):
+        with self.lock:
+            self.views.clear()
+
+    def render(self):
+        '''
+        :return: the metrics in the Prometheus text exposition format
+        '''
+        histograms = [
+            ('foodtasker_request_duration_seconds', 'Wall time of the request', 'duration'),
+            ('foodtasker_request_queries', 'Number of SQL queries of the request', 'queries'),
+            ('foodtasker_request_query_duration_seconds', 'Time spent in SQL queries', 'query_duration'),
+            ('foodtasker_response_size_bytes', 'Size of the response body', 'response_size'),
+        ]
+        lines = []
+        with self.lock:
+            for name, help_text, attribute in histograms:
+                lines.append('# HELP %s %s' % (name, help_text))
+                lines.append('# TYPE %s histogram' % name)
+                for view, metrics in self.views.items():
+                    histogram = getattr(metrics, attribute)
+                    labels = 'view="%s"' % escape(view)
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, count))
+                    lines.append('%s_bucket{%s,le="+Inf"} %d' % (name, labels, histogram.count))
+                    lines.append('%s_sum{%s} %s' % (name, labels, histogram.sum))
+                    lines.append('%s_count{%s} %d' % (name, labels, histogram.count))
+
+            name = 'foodtasker_duplicate_queries_total'
+            lines.append('# HELP %s Repeated executions of the same statement within a request' % name)
+            lines.append('# TYPE %s counter' % name)
+            for view, metrics in self.views.items():
+                for sql, count in metrics.duplicates.most_common(TOP_DUPLICATES):
+                    lines.append('%s{view="%s",sql="%s"} %d' % (name, escape(view), escape(sql), count))
+        return '\n'.join(lines) + '\n'
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+metrics = Metrics()
+
+
+def metrics_response(request):
+    '''
+    Prometheus scrape endpoint. Requires "Authorization: Bearer <METRICS_TOKEN>",
+    and does not exist when METRICS_TOKEN is not set.
+    '''
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if not token:
+        raise Http404
+    if not constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), 'Bearer %s' % token):
+        return HttpResponse(status=403)
+    return HttpResponse(metrics.render() + dbpool.stats.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class ProfilingMiddleware(object):
+    '''
+    Record wall time, SQL queries and response size of every request under
+    the name of the view that served it. A PROFILING_SAMPLE_RATE fraction of
+    the requests also runs under cProfile, and the stats of those slower
+    than PROFILING_SLOW_REQUEST seconds are written to PROFILING_DIR.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0)
+        self.slow_request = getattr(settings, 'PROFILING_SLOW_REQUEST', 1)
+        self.directory = getattr(settings, 'PROFILING_DIR', None)
+
+    def __call__(self, request):
+        # the connection only logs its queries in DEBUG unless forced
+        force_debug_cursor = connection.force_debug_cursor
+        connection.force_debug_cursor = True
+        queries_before = len(connection.queries_log)
+
+        profiler = None
+        if self.directory and self.sample_rate and random.random() < self.sample_rate:
+            profiler = cProfile.Profile()
+
+        start = time.perf_counter()
+        try:
+            if profiler is not None:
+                response = profiler.runcall(self.get_response, request)
+            else:
+                response = self.get_response(request)
+        finally:
+            duration = time.perf_counter() - start
+            connection.force_debug_cursor = force_debug_cursor
+
+        queries = [(query['sql'], float(query['time'])) for query in list(connection.queries_log)[queries_before:]]
+        view = self.view_name(request)
+        # streamed bodies are still being produced, only their headers are timed
+        size = 0 if response.streaming else len(response.content)
+        metrics.record(view, duration, queries, size)
+
+        if profiler is not None and duration >= self.slow_request:
+            self.dump(profiler, view, duration)
+        return response
+
+    def view_name(self, request):
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return '<unresolved>'
+        return match.view_name
+
+    def dump(self, profiler, view, duration):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, '%s-%d-%dms.prof' % (
+                re.sub(r'[^\w.-]', '_', view), time.time() * 1000, duration * 1000))
+            profiler.dump_stats(path)
+            logger.warning('Slow request to %s took %.0f ms, profile written to %s', view, duration * 1000, path)
+        except OSError:
+            logger.exception('Could not write the profile of %s', view)
@@ -0,0 +1,181 @@
+from datetime import datetime, time, timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.dispatch import receiver
+from django.utils import timezone
+
+from foodtaskerapp.models import DailySales, Order, OrderDetails
+from foodtaskerapp.signals import order_status_changed
+
+# Totals of past days never change, keep them for a week
+PAST_DAY_TIMEOUT = 7 * 24 * 60 * 60
+
+
+def today():
+    return timezone.localtime(timezone.now()).date()
+
+
+def is_settled(day):
+    '''
+    Orders created yesterday may still be delivered today, only days before
+    that are final
+    '''
+    return day < today() - timedelta(days = 1)
+
+
+def current_week():
+    '''
+    Return the dates of the current week, Monday first
+    '''
+    day = today()
+    return [day + timedelta(days = i) for i in range(0 - day.weekday(), 7 - day.weekday())]
+
+
+def daily_totals(orders, days, cache_key=None):
+    '''
+    Revenue and number of orders per day, computed with a single GROUP BY
+    query over the orders created on the given days
+    :param orders: Order queryset to report on, e.g. delivered orders of a driver
+    :param days: list of dates
+    :param cache_key: identifies the queryset, totals of past days are cached under it
+    :return: dict of date -> (revenue, number of orders)
+    '''
+    totals = {}
+    if cache_key:
+        cached = cache.get_many(['%s:%s' % (cache_key, day.isoformat()) for day in days if is_settled(day)])
+        for day in days:
+            key = '%s:%s' % (cache_key, day.isoformat())
+            if key in cached:
+                totals[day] = cached[key]
+
+    missing = [day for day in days if day not in totals]
+    if not missing:
+        return totals
+
+    start = timezone.make_aware(datetime.combine(min(missing), time.min))
+    end = timezone.make_aware(datetime.combine(max(missing) + timedelta(days = 1), time.min))
+    rows = orders.filter(created_at__gte = start, created_at__lt = end)\
+                 .annotate(day = TruncDate('created_at'))\
+                 .order_by()\
+                 .values('day')\
+                 .annotate(revenue = Sum('total'), count = Count('id'))
+    computed = dict((row['day'], (row['revenue'], row['count'])) for row in rows)
+
+    past = {}
+    for day in missing:
+        totals[day] = computed.get(day, (0, 0))
+        if cache_key and is_settled(day):
+            past['%s:%s' % (cache_key, day.isoformat())] = totals[day]
+    if past:
+        cache.set_many(past, PAST_DAY_TIMEOUT)
+
+    return totals
+
+
+def record_delivered_order(order):
+    '''
+    Add a delivered order to the DailySales rollup, one row for the order
+    and one per meal, creating the rows of the day when needed
+    '''
+    day = timezone.localtime(order.created_at).date()
+    lines = [(None, order.total, 0, 1)]
+    lines += [(detail.meal_id, detail.sub_total, detail.quantity, 0) for detail in order.order_details.all()]
+
+    with transaction.atomic():
+        for meal_id, revenue, quantity, orders in lines:
+            key = dict(restaurant_id = order.restaurant_id, day = day, meal_id = meal_id, driver_id = order.driver_id)
+            updated = DailySales.objects.filter(**key).update(
+                revenue = F('revenue') + revenue,
+                quantity = F('quantity') + quantity,
+                orders = F('orders') + orders
+            )
+            if not updated:
+                DailySales.objects.create(revenue = revenue, quantity = quantity, orders = orders, **key)
+
+
+def backfill_daily_sales(restaurant_ids=None):
+    '''
+    Rebuild the DailySales rollup from the order history
+    :param restaurant_ids: only rebuild these restaurants, default all
+    :return: number of rollup rows written
+    '''
+    orders = Order.objects.filter(status = Order.DELIVERED)
+    details = OrderDetails.objects.filter(order__status = Order.DELIVERED)
+    rollup = DailySales.objects.all()
+    if restaurant_ids:
+        orders = orders.filter(restaurant_id__in = restaurant_ids)
+        details = details.filter(order__restaurant_id__in = restaurant_ids)
+        rollup = rollup.filter(restaurant_id__in = restaurant_ids)
+
+    order_rows = orders.annotate(day = TruncDate('created_at'))\
+                       .order_by()\
+                       .values('restaurant', 'day', 'driver')\
+                       .annotate(total_revenue = Sum('total'), total_orders = Count('id'))
+    meal_rows = details.annotate(day = TruncDate('order__created_at'))\
+                       .order_by()\
+                       .values('order__restaurant', 'day', 'meal', 'order__driver')\
+                       .annotate(total_revenue = Sum('sub_total'), total_quantity = Sum('quantity'))
+
+    rows = [
+        DailySales(restaurant_id = row['restaurant'], day = row['day'], driver_id = row['driver'],
+                   revenue = row['total_revenue'], orders = row['total_orders'])
+        for row in order_rows
+    ]
+    rows += [
+        DailySales(restaurant_id = row['order__restaurant'], day = row['day'], meal_id = row['meal'],
+                   driver_id = row['order__driver'], revenue = row['total_revenue'], quantity = row['total_quantity'])
+        for row in meal_rows
+    ]
+
+    with transaction.atomic():
+        rollup.delete()
+        DailySales.objects.bulk_create(rows)
+    return len(rows)
+
+
+def daily_sales(restaurant, days):
+    '''
+    Revenue and number of delivered orders per day, from the rollup
+    :return: dict of date -> (revenue, number of orders)
+    '''
+    rows = DailySales.objects.filter(restaurant = restaurant, meal = None, day__range = (min(days), max(days)))\
+                             .values('day')\
+                             .annotate(total_revenue = Sum('revenue'), total_orders = Sum('orders'))
+    totals = dict((row['day'], (row['total_revenue'], row['total_orders'])) for row in rows)
+    return dict((day, totals.get(day, (0, 0))) for day in days)
+
+
+def top_meals(restaurant, limit=3):
+    '''
+    Best selling meals of a restaurant, from the rollup
+    :return: list of (meal name, quantity sold)
+    '''
+    rows = DailySales.objects.filter(restaurant = restaurant, meal__isnull = False)\
+                             .values('meal', 'meal__name')\
+                             .annotate(total_quantity = Sum('quantity'))\
+                             .order_by('-total_quantity')[:limit]
+    return [(row['meal__name'], row['total_quantity']) for row in rows]
+
+
+def top_drivers(restaurant, limit=3):
+    '''
+    Drivers who delivered the most orders of a restaurant, from the rollup
+    :return: list of (driver name, number of orders)
+    '''
+    rows = DailySales.objects.filter(restaurant = restaurant, meal = None, driver__isnull = False)\
+                             .values('driver', 'driver__user__first_name', 'driver__user__last_name')\
+                             .annotate(total_orders = Sum('orders'))\
+                             .order_by('-total_orders')[:limit]
+    return [
+        (('%s %s' % (row['driver__user__first_name'], row['driver__user__last_name'])).strip(), row['total_orders'])
+        for row in rows
+    ]
+
+
+@receiver(order_status_changed, dispatch_uid='reports_order_status_changed')
+def update_daily_sales(sender, order, previous_status, **kwargs):
+    if order.status == Order.DELIVERED and previous_status != Order.DELIVERED:
+        record_delivered_order(order)
@@ -1,18 +1,31 @@
+from django.core.files.storage import default_storage
+from django.utils.encoding import filepath_to_uri
 from rest_framework import serializers
-from foodtaskerapp.models import Restaurant, Meal, Customer, Driver, Order, OrderDetails
+from foodtaskerapp import images
+from foodtaskerapp.models import Restaurant, Meal, Customer, Driver, Order, OrderDetails, local_now
+
+
+def absolute_renditions(request, field_file, digest):
+    return images.rendition_urls(field_file.name, digest,
+                                 lambda name: request.build_absolute_uri(default_storage.url(name)))
 
 
 class RestaurantSerializer(serializers.ModelSerializer):
     logo = serializers.SerializerMethodField()
+    logo_renditions = serializers.SerializerMethodField()
 
 
     def get_logo(self, restaurant):
         request = self.context.get('request')
         logo_url = restaurant.logo.url
         return request.build_absolute_uri(logo_url)
+
+    def get_logo_renditions(self, restaurant):
+        # sizes and formats of the logo, null until they are generated
+        return absolute_renditions(self.context.get('request'), restaurant.logo, restaurant.logo_hash)
     class Meta:
         model = Restaurant
-        fields = ("id", "name", "phone", "address", "logo", "opening_time", "closing_time",
+        fields = ("id", "name", "phone", "address", "logo", "logo_renditions", "opening_time", "closing_time",
                   "latitude", "longitude", "is_open")
 
 
@@ -20,14 +33,19 @@ class RestaurantSerializer(serializers.ModelSerializer):
 class MealSerializer(serializers.ModelSerializer):
 
     image = serializers.SerializerMethodField()
+    image_renditions = serializers.SerializerMethodField()
 
     def get_image(self, meal):
         request = self.context.get('request')
         image_url = meal.image.url
         return request.build_absolute_uri(image_url)
+
+    def get_image_renditions(self, meal):
+        # sizes and formats of the image, null until they are generated
+        return absolute_renditions(self.context.get('request'), meal.image, meal.image_hash)
     class Meta:
         model = Meal
-        fields = ("id", "name", "short_description", "image", "price")
+        fields = ("id", "name", "short_description", "image", "image_renditions", "price")
 
 
 
@@ -81,3 +99,142 @@ class OrderSerializer(serializers.ModelSerializer):
         model = Order
         fields = ("id", "customer", "restaurant", "driver", "order_details",
                   "total", "status", "address", "extra_notes")
+
+
+# FAST READ SERIALIZERS
+# Plain dicts built from .values() rows for the hot read paths. The output
+# is the same as the serializers above, without instantiating models or
+# introspecting fields per row.
+
+RESTAURANT_VALUES = ("id", "name", "phone", "address", "logo", "logo_hash", "opening_time", "closing_time",
+                     "latitude", "longitude", "is_open_for_orders")
+
+MEAL_VALUES = ("id", "name", "short_description", "image", "image_hash", "price", "category_id")
+
+
+class MediaUrls(object):
+    '''
+    Absolute media urls for one request, the base is only built once
+    '''
+
+    def __init__(self, request):
+        self.base = request.build_absolute_uri(default_storage.url(""))
+
+    def url(self, name):
+        return self.base + filepath_to_uri(name)
+
+    def renditions(self, name, digest):
+        return images.rendition_urls(name, digest, self.url)
+
+
+def decimal_string(value):
+    # DRF renders decimals as strings
+    return None if value is None else str(value)
+
+
+def time_string(value):
+    return None if value is None else value.isoformat()
+
+
+def fast_restaurant(row, media, moment):
+    return {
+        "id": row["id"],
+        "name": row["name"],
+        "phone": row["phone"],
+        "address": row["address"],
+        "logo": media.url(row["logo"]),
+        "logo_renditions": media.renditions(row["logo"], row["logo_hash"]),
+        "opening_time": time_string(row["opening_time"]),
+        "closing_time": time_string(row["closing_time"]),
+        "latitude": decimal_string(row["latitude"]),
+        "longitude": decimal_string(row["longitude"]),
+        "is_open": row["is_open_for_orders"] and
+                   Restaurant.hours_include(row["opening_time"], row["closing_time"], moment),
+    }
+
+
+def fast_restaurants(queryset, request):
+    media = MediaUrls(request)
+    moment = local_now().time()
+    return [fast_restaurant(row, media, moment) for row in queryset.values(*RESTAURANT_VALUES)]
+
+
+def fast_meal(row, media):
+    return {
+        "id": row["id"],
+        "name": row["name"],
+        "short_description": row["short_description"],
+        "image": media.url(row["image"]),
+        "image_renditions": media.renditions(row["image"], row["image_hash"]),
+        "price": decimal_string(row["price"]),
+    }
+
+
+def fast_meals(queryset, request):
+    '''
+    :return: list of (serialized meal, category id)
+    '''
+    media = MediaUrls(request)
+    return [(fast_meal(row, media), row["category_id"]) for row in queryset.values(*MEAL_VALUES)]
+
+
+ORDER_VALUES = (
+    "id", "total", "status", "address", "extra_notes",
+    "customer_id", "customer__avatar", "customer__phone", "customer__address",
+    "customer__user__first_name", "customer__user__last_name",
+    "driver_id", "driver__avatar", "driver__phone", "driver__address",
+    "driver__user__first_name", "driver__user__last_name",
+    "restaurant_id", "restaurant__name", "restaurant__phone", "restaurant__address",
+)
+
+STATUS_DISPLAY = dict(Order.STATUS_CHOICES)
+
+
+def full_name(first_name, last_name):
+    # User.get_full_name()
+    return ("%s %s" % (first_name, last_name)).strip()
+
+
+def fast_person(row, prefix):
+    if row[prefix + "_id"] is None:
+        return None
+    return {
+        "id": row[prefix + "_id"],
+        "name": full_name(row[prefix + "__user__first_name"], row[prefix + "__user__last_name"]),
+        "avatar": row[prefix + "__avatar"],
+        "phone": row[prefix + "__phone"],
+        "address": row[prefix + "__address"],
+    }
+
+
+def fast_orders(rows):
+    '''
+    Serialize Order .values(*ORDER_VALUES) rows like OrderSerializer, with
+    one more query for the details of all of them
+    '''
+    details = {}
+    for detail in OrderDetails.objects.filter(order_id__in = [row["id"] for row in rows]).order_by("id")\
+            .values("id", "order_id", "quantity", "sub_total", "meal_id", "meal__name", "meal__price"):
+        details.setdefault(detail["order_id"], []).append({
+            "id": detail["id"],
+            "meal": {"id": detail["meal_id"], "name": detail["meal__name"], "price": decimal_string(detail["meal__price"])},
+            "quantity": detail["quantity"],
+            "sub_total": decimal_string(detail["sub_total"]),
+        })
+
+    return [{
+        "id": row["id"],
+        "customer": fast_person(row, "customer"),
+        "restaurant": {
+            "id": row["restaurant_id"],
+            "name": row["restaurant__name"],
+            "phone": row["restaurant__phone"],
+            "address": row["restaurant__address"],
+        },
+        "driver": fast_person(row, "driver"),
+        "order_details": details.get(row["id"], []),
+        "total": decimal_string(row["total"]),
+        "status": STATUS_DISPLAY.get(row["status"]),
+        "address": row["address"],
+        "extra_notes": row["extra_notes"],
+    } for row in rows]
@@ -0,0 +1,23 @@
+from django.db.models.signals import post_init, post_save
+from django.dispatch import Signal, receiver
+
+from foodtaskerapp.models import Order
+
+# Sent whenever an order is created or its status changes. previous_status
+# is None for new orders. Code that changes the status with a queryset
+# update() has to send it itself, as foodtaskerapp.lifecycle.transition does.
+order_status_changed = Signal(providing_args=['order', 'previous_status'])
+
+
+@receiver(post_init, sender=Order, dispatch_uid='signals_order_loaded')
+def remember_order_status(sender, instance, **kwargs):
+    # deferred fields must not be loaded here
+    instance._loaded_status = instance.__dict__.get('status')
+
+
+@receiver(post_save, sender=Order, dispatch_uid='signals_order_saved')
+def order_saved(sender, instance, created, **kwargs):
+    previous_status = None if created else instance._loaded_status
+    instance._loaded_status = instance.status
+    if created or instance.status != previous_status:
+        order_status_changed.send(sender=Order, order=instance, previous_status=previous_status)
@@ -1,3 +1,449 @@
-from django.test import TestCase
+import random
+import threading
+from collections import Counter
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import stripe
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.utils import timezone
+from oauth2_provider.models import AccessToken, Application
+
+from foodtaskerapp import dbpool, dispatch, lifecycle, notifications, payments, tokens
+from foodtaskerapp.models import (Customer, Driver, Meal, Order, OrderDetails, Restaurant, RevokedToken,
+                                  UserNotification)
+
+
+def create_restaurant(username='restaurant'):
+    user = User.objects.create(username=username)
+    return Restaurant.objects.create(user=user, name='Restaurant', phone='0', address='Test Street',
+                                     logo='restaurant_logo/test.png', latitude=-34.92, longitude=138.60)
+
+
+def create_customer(username='customer'):
+    return Customer.objects.create(user=User.objects.create(username=username), avatar='')
+
+
+def create_driver(username='driver'):
+    return Driver.objects.create(user=User.objects.create(username=username), avatar='')
+
+
+def create_token(user):
+    application = Application.objects.get_or_create(
+        name='test', user=user, client_type=Application.CLIENT_CONFIDENTIAL,
+        authorization_grant_type=Application.GRANT_PASSWORD
+    )[0]
+    return AccessToken.objects.create(user=user, application=application, token='token-%s' % user.username,
+                                      scope='read write', expires=timezone.now() + timedelta(hours=1)).token
+
+
+@override_settings(PAYMENT_GATEWAY='foodtaskerapp.payments.StubGateway', PAYMENT_MAX_RETRIES=2)
+@mock.patch('foodtaskerapp.payments.time.sleep')
+class PaymentTests(TestCase):
+
+    def setUp(self):
+        self.restaurant = create_restaurant()
+        self.customer = create_customer()
+
+    def place_order(self, source, **fields):
+        return Order.objects.create(customer=self.customer, restaurant=self.restaurant, address='Test Street',
+                                    total=20, status=Order.PENDING_PAYMENT, payment_source=source, **fields)
+
+    def assertActiveOrder(self, order_id):
+        self.assertEqual(Customer.objects.get(id=self.customer.id).active_order_id, order_id)
+
+    def test_paid(self, sleep):
+        order = self.place_order('tok_visa')
+
+        self.assertIs(payments.charge_order(order.id), True)
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.PREPARING)
+        self.assertTrue(order.charge_id.startswith('ch_stub_'))
+        self.assertIsNotNone(order.paid_at)
+        self.assertEqual(order.payment_source, '')
+        self.assertActiveOrder(order.id)
+        sleep.assert_not_called()
+
+    def test_declined(self, sleep):
+        order = self.place_order('tok_declined')
+
+        self.assertIs(payments.charge_order(order.id), False)
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.PAYMENT_FAILED)
+        self.assertEqual(order.charge_id, '')
+        self.assertActiveOrder(None)
+        sleep.assert_not_called()
+
+    def test_retried_then_paid(self, sleep):
+        order = self.place_order('tok_flaky')
+
+        self.assertIs(payments.charge_order(order.id), True)
+        self.assertEqual(Order.objects.get(id=order.id).status, Order.PREPARING)
+        self.assertEqual(payments.StubGateway.attempts[order.payment_key], 2)
+        self.assertEqual(sleep.call_count, 1)
+
+    def test_retries_exhausted(self, sleep):
+        order = self.place_order('tok_unavailable')
+
+        self.assertIs(payments.charge_order(order.id), False)
+        self.assertEqual(Order.objects.get(id=order.id).status, Order.PAYMENT_FAILED)
+        # the first attempt and PAYMENT_MAX_RETRIES retries
+        self.assertEqual(payments.StubGateway.attempts[order.payment_key], 3)
+        self.assertEqual(sleep.call_count, 2)
+        self.assertActiveOrder(None)
+
+    def test_settled_orders_are_not_charged_again(self, sleep):
+        order = self.place_order('tok_visa')
+        payments.charge_order(order.id)
+
+        self.assertIsNone(payments.charge_order(order.id))
+        self.assertEqual(payments.StubGateway.attempts[order.payment_key], 1)
+
+    @override_settings(PAYMENT_GATEWAY='foodtaskerapp.payments.StripeGateway')
+    def test_stripe_request_errors_fail_the_order(self, sleep):
+        order = self.place_order('tok_used')
+        error = stripe.error.InvalidRequestError('You cannot use a Stripe token more than once', 'source')
+
+        with mock.patch('stripe.Charge.create', side_effect=error):
+            self.assertIs(payments.charge_order(order.id), False)
+        self.assertEqual(Order.objects.get(id=order.id).status, Order.PAYMENT_FAILED)
+        self.assertActiveOrder(None)
+
+    def test_sweep_settles_stale_orders(self, sleep):
+        stale = self.place_order('tok_visa', created_at=timezone.now() - timedelta(hours=1))
+        other = create_customer('other')
+        recent = Order.objects.create(customer=other, restaurant=self.restaurant, address='Test Street', total=20,
+                                      status=Order.PENDING_PAYMENT, payment_source='tok_visa')
+
+        self.assertEqual(payments.sweep_pending_payments(), 1)
+        self.assertEqual(Order.objects.get(id=stale.id).status, Order.PREPARING)
+        self.assertEqual(Order.objects.get(id=recent.id).status, Order.PENDING_PAYMENT)
+
+    def test_sweep_fails_stale_orders_without_a_card_token(self, sleep):
+        stale = self.place_order('', created_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(payments.sweep_pending_payments(), 1)
+        self.assertEqual(Order.objects.get(id=stale.id).status, Order.PAYMENT_FAILED)
+        self.assertActiveOrder(None)
+
+
+# the dashboard templates must render without collectstatic's manifest
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+                   TOKEN_REVOCATION_CHECK_INTERVAL=60)
+class OrderQueryCountTests(TestCase):
+    '''
+    The order endpoints cost the same queries however many lines the
+    orders have and however many orders are listed
+    '''
+
+    def setUp(self):
+        # profiles cached by an earlier test would belong to rolled back rows
+        tokens.cache.clear()
+        self.restaurant = create_restaurant()
+        self.customer = create_customer()
+        self.driver = create_driver()
+        self.meals = [Meal.objects.create(restaurant=self.restaurant, name='Meal %d' % i, short_description='Meal',
+                                          image='meal_images/test.png', price=10)
+                      for i in range(3)]
+
+    def create_order(self, customer, status, lines=3):
+        order = Order.objects.create(customer=customer, restaurant=self.restaurant, driver=self.driver,
+                                     address='Test Street', total=10 * lines, status=status,
+                                     picked_at=timezone.now())
+        OrderDetails.objects.bulk_create([
+            OrderDetails(order=order, meal=meal, quantity=1, sub_total=10) for meal in self.meals[:lines]
+        ])
+        return order
+
+    def test_customer_latest_order(self):
+        order = self.create_order(self.customer, Order.ONTHEWAY)
+        token = create_token(self.customer.user)
+        self.client.get('/api/customer/order/latest/', {'access_token': token})
+
+        # the order, its lines and their meals
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/customer/order/latest/', {'access_token': token})
+        self.assertEqual(response.json()['order']['id'], order.id)
+        self.assertEqual(len(response.json()['order']['order_details']), 3)
+
+    def test_driver_latest_order(self):
+        order = self.create_order(self.customer, Order.ONTHEWAY)
+        token = create_token(self.driver.user)
+        self.client.get('/api/driver/order/latest/', {'access_token': token})
+
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/driver/order/latest/', {'access_token': token})
+        self.assertEqual(response.json()['order']['id'], order.id)
+        self.assertEqual(len(response.json()['order']['order_details']), 3)
+
+    def test_driver_ready_orders(self):
+        location = {'latitude': -34.92, 'longitude': 138.60}
+        self.create_order(self.customer, Order.READY, lines=1)
+        Order.objects.update(driver=None)
+
+        # nearby restaurants, the orders, then their lines with the meals
+        with self.assertNumQueries(3):
+            self.client.get('/api/driver/orders/ready/', location)
+
+        for i in range(5):
+            self.create_order(create_customer('customer-%d' % i), Order.READY)
+        Order.objects.update(driver=None)
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/driver/orders/ready/', location)
+        self.assertEqual(len(response.json()['orders']), 6)
+        self.assertEqual(sum(len(order['order_details']) for order in response.json()['orders']), 16)
+
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/driver/orders/ready/', dict(location, page_size=4))
+        self.assertEqual(len(response.json()['orders']), 4)
+
+    def test_restaurant_orders(self):
+        self.client.force_login(self.restaurant.user, backend='django.contrib.auth.backends.ModelBackend')
+        self.create_order(self.customer, Order.PREPARING, lines=1)
+
+        # session, user and restaurant, then the orders, their lines and meals
+        with self.assertNumQueries(6):
+            self.client.get('/restaurant/order/')
+
+        for i in range(5):
+            self.create_order(create_customer('customer-%d' % i), Order.READY)
+        with self.assertNumQueries(6):
+            response = self.client.get('/restaurant/order/')
+        self.assertEqual(len(response.context['orders']), 6)
+
+
+# SQLite test databases fail concurrent writers instead of serializing them
+@skipUnlessDBFeature('has_select_for_update')
+class ClaimOrderTests(TransactionTestCase):
+    '''
+    Drivers claiming the same orders from parallel threads, each on its own
+    connection, never get the same order
+    '''
+
+    def test_no_order_goes_to_two_drivers(self):
+        restaurant = create_restaurant()
+        customer = create_customer()
+        drivers = [create_driver('driver-%d' % i) for i in range(8)]
+        order_ids = [Order.objects.create(customer=customer, restaurant=restaurant, address='Test Street', total=10,
+                                          status=Order.READY).id
+                     for i in range(40)]
+        claims = dict((driver.id, []) for driver in drivers)
+        errors = []
+        start = threading.Barrier(len(drivers))
+
+        def run(driver):
+            candidates = list(order_ids)
+            random.Random(driver.id).shuffle(candidates)
+            try:
+                start.wait()
+                for order_id in candidates:
+                    if dispatch.claim_order(order_id, driver):
+                        claims[driver.id].append(order_id)
+                        # deliver at once to be free for the next claim
+                        lifecycle.transition(order_id, Order.ONTHEWAY, Order.DELIVERED)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(driver,)) for driver in drivers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        claimed = Counter(order_id for driver_claims in claims.values() for order_id in driver_claims)
+        self.assertEqual([order_id for order_id, count in claimed.items() if count > 1], [])
+        self.assertEqual(sorted(claimed), sorted(order_ids))
+        claimer = dict((order_id, driver_id) for driver_id, driver_claims in claims.items() for order_id in driver_claims)
+        self.assertEqual(dict(Order.objects.values_list('id', 'driver_id')), claimer)
+
+
+class MetricsTests(TestCase):
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_hidden_without_a_token(self):
+        self.assertEqual(self.client.get('/metrics/').status_code, 404)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_requires_the_token(self):
+        self.assertEqual(self.client.get('/metrics/').status_code, 403)
+        self.assertEqual(self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        response = self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'foodtasker_request_duration_seconds', response.content)
+
+
+@override_settings(TOKEN_REVOCATION_CHECK_INTERVAL=0)
+class TokenCacheTests(TestCase):
+
+    def setUp(self):
+        tokens.cache.clear()
+        self.customer = create_customer()
+        self.token = create_token(self.customer.user)
+
+    def test_revoked_here(self):
+        self.assertEqual(tokens.get_customer(self.token), self.customer)
+        AccessToken.objects.get(token=self.token).delete()
+
+        with self.assertRaises(AccessToken.DoesNotExist):
+            tokens.get_customer(self.token)
+
+    def test_revoked_by_another_process(self):
+        self.assertEqual(tokens.get_customer(self.token), self.customer)
+        # as another process would, without this process seeing the signal
+        AccessToken.objects.filter(token=self.token).update(expires=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(tokens.get_customer(self.token), self.customer)
+
+        RevokedToken.objects.create(token=self.token)
+        with self.assertRaises(AccessToken.DoesNotExist):
+            tokens.get_customer(self.token)
+
+    def test_other_tokens_stay_cached(self):
+        other = create_customer('other')
+        other_token = create_token(other.user)
+        tokens.get_customer(self.token)
+        tokens.get_customer(other_token)
+
+        RevokedToken.objects.create(token=self.token)
+        # a sync on every call, and the revoked token read again
+        with self.assertNumQueries(3):
+            self.assertEqual(tokens.get_customer(other_token), other)
+            self.assertEqual(tokens.get_customer(self.token), self.customer)
+
+    @mock.patch('foodtaskerapp.tokens.transaction.on_commit', side_effect=lambda callback: callback())
+    def test_only_live_tokens_are_recorded(self, on_commit):
+        AccessToken.objects.get(token=self.token).delete()
+        expired = create_token(create_customer('other').user)
+        AccessToken.objects.filter(token=expired).update(expires=timezone.now() - timedelta(seconds=1))
+        AccessToken.objects.get(token=expired).delete()
+
+        self.assertEqual(list(RevokedToken.objects.values_list('token', flat=True)), [self.token])
+
+
+class NotificationPollerTests(TestCase):
+
+    def setUp(self):
+        self.hub = notifications.NotificationHub()
+        self.poller = notifications.NotificationPoller(self.hub)
+        self.restaurant = create_restaurant()
+        self.user_id = self.restaurant.user_id
+        self.since = timezone.now()
+
+    def test_publishes_to_connected_users_once(self):
+        self.hub.subscribe(self.user_id)
+        cursor = self.hub.cursor()
+        notification = UserNotification.objects.create(user_id=self.user_id, notification='{}')
+
+        with self.assertNumQueries(1):
+            since = self.poller.poll(self.since)
+        cursor, events, watermark = self.hub.wait(self.user_id, cursor, 0)
+        self.assertEqual(events, [(notification.id, notification.created_at, '{}')])
+        self.assertEqual(watermark, since)
+
+        # read again within the overlap, but not published twice
+        self.poller.poll(since)
+        self.assertEqual(self.hub.wait(self.user_id, cursor, 0)[1], [])
+
+    def test_no_query_without_connected_users(self):
+        UserNotification.objects.create(user_id=self.user_id, notification='{}')
+
+        with self.assertNumQueries(0):
+            self.poller.poll(self.since)
+        self.hub.subscribe(self.user_id)
+        self.assertEqual(self.hub.wait(self.user_id, 0, 0)[1], [])
+
+
+class NotificationStreamTests(TestCase):
+
+    def test_requires_a_signed_in_restaurant(self):
+        response = self.client.get('/api/restaurant/order/stream/')
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].startswith('/restaurant/sign-in/'))
+
+    @override_settings(NOTIFICATION_RETENTION=600)
+    def test_prune_keeps_the_replay_window(self):
+        user_id = create_restaurant().user_id
+        UserNotification.objects.create(user_id=user_id, notification='{}',
+                                        created_at=timezone.now() - timedelta(seconds=601))
+        recent = UserNotification.objects.create(user_id=user_id, notification='{}')
+
+        self.assertEqual(notifications.prune(), 1)
+        self.assertEqual(list(UserNotification.objects.values_list('id', flat=True)), [recent.id])
+
+
+class PoolStatsTests(TestCase):
+
+    def test_background_threads_are_not_counted(self):
+        size = dbpool.stats.size()
+
+        def run():
+            # like the worker threads and the location flusher
+            try:
+                User.objects.exists()
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(dbpool.stats.size(), size)
+
+
+class ReadyOrdersTests(TestCase):
+    location = {'latitude': -34.92, 'longitude': 138.60}
+
+    def setUp(self):
+        restaurant = create_restaurant()
+        customer = create_customer()
+        self.order_ids = [Order.objects.create(customer=customer, restaurant=restaurant, address='Test Street',
+                                               total=10, status=Order.READY).id
+                          for i in range(25)]
+
+    def get(self, **params):
+        params.update(self.location)
+        return self.client.get('/api/driver/orders/ready/', params).json()
+
+    def test_whole_list_for_released_apps(self):
+        response = self.get()
+        self.assertEqual([order['id'] for order in response['orders']], self.order_ids[::-1])
+        self.assertNotIn('next_cursor', response)
+
+    def test_pages_on_request(self):
+        first = self.get(page_size=20)
+        self.assertEqual(len(first['orders']), 20)
+        second = self.get(cursor=first['next_cursor'])
+        self.assertEqual([order['id'] for order in first['orders'] + second['orders']], self.order_ids[::-1])
+        self.assertIsNone(second['next_cursor'])
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class OrderChangesTests(TestCase):
+
+    def setUp(self):
+        self.restaurant = create_restaurant()
+        self.client.force_login(self.restaurant.user, backend='django.contrib.auth.backends.ModelBackend')
+        customer = create_customer()
+        self.order_ids = [Order.objects.create(customer=customer, restaurant=self.restaurant, address='Test Street',
+                                               total=10, status=Order.PREPARING).id
+                          for i in range(5)]
+
+    def changes(self, since, **params):
+        params['since'] = since
+        return self.client.get('/restaurant/order/changes/', params).json()
+
+    @mock.patch('foodtaskerapp.views.CHANGES_LIMIT', 3)
+    def test_truncated_changes_resume_after_the_last_order_sent(self):
+        first = self.changes((timezone.now() - timedelta(hours=1)).isoformat())
+        self.assertEqual([order['id'] for order in first['orders']], self.order_ids[:3])
+        self.assertEqual(first['watermark'], Order.objects.get(id=self.order_ids[2]).updated_at.isoformat())
+        self.assertEqual(first['after'], self.order_ids[2])
+
+        second = self.changes(first['watermark'], after=first['after'])
+        self.assertEqual([order['id'] for order in second['orders']], self.order_ids[3:])
+        self.assertIsNone(second['after'])
@@ -0,0 +1,149 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from oauth2_provider.models import AccessToken
+
+from foodtaskerapp.models import RevokedToken
+
+# Seconds each sync reaches back before the last one, for revocations
+# stamped just before they committed or by a server with a skewed clock
+REVOCATION_OVERLAP = 5
+
+
+class TokenCache(object):
+    '''
+    Thread safe LRU cache whose entries also expire at a given time
+    '''
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.synced_at = None
+        self.checked_at = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at):
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete_token(self, token):
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == token]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.synced_at = None
+            self.checked_at = 0
+
+    def sync(self, interval):
+        '''
+        Drop the tokens revoked by any process since the last check. Checks
+        at most once every interval seconds.
+        '''
+        now = time.time()
+        with self.lock:
+            if now - self.checked_at < interval:
+                return
+            self.checked_at = now
+            synced_at = self.synced_at
+        watermark = timezone.now()
+        if synced_at is not None:
+            revoked = set(RevokedToken.objects.filter(
+                revoked_at__gt=synced_at - timedelta(seconds=REVOCATION_OVERLAP)
+            ).values_list('token', flat=True))
+            with self.lock:
+                for key in [key for key in self.entries if key[0] in revoked]:
+                    del self.entries[key]
+        with self.lock:
+            self.synced_at = watermark
+
+
+cache = TokenCache(getattr(settings, 'TOKEN_CACHE_SIZE', 10000))
+
+
+def get_customer(token):
+    '''
+    Return the customer owning a valid access token
+    :raises AccessToken.DoesNotExist: if the token is unknown or expired
+    :raises Customer.DoesNotExist: if the token's user is not a customer
+    '''
+    return _resolve(token, 'customer')
+
+
+def get_driver(token):
+    '''
+    Return the driver owning a valid access token
+    :raises AccessToken.DoesNotExist: if the token is unknown or expired
+    :raises Driver.DoesNotExist: if the token's user is not a driver
+    '''
+    return _resolve(token, 'driver')
+
+
+def _resolve(token, profile):
+    cache.sync(getattr(settings, 'TOKEN_REVOCATION_CHECK_INTERVAL', 2))
+    key = (token, profile)
+    instance = cache.get(key)
+    if instance is not None:
+        return instance
+
+    # token, user and profile in a single joined query
+    access_token = AccessToken.objects.select_related('user__' + profile).get(
+        token=token,
+        expires__gt=timezone.now()
+    )
+    instance = getattr(access_token.user, profile)
+
+    # never keep a profile past the token's own expiry
+    ttl = getattr(settings, 'TOKEN_CACHE_TTL', 60)
+    cache.set(key, instance, min(time.time() + ttl, access_token.expires.timestamp()))
+    return instance
+
+
+@receiver(post_save, sender=AccessToken, dispatch_uid='tokens_access_token_saved')
+@receiver(post_delete, sender=AccessToken, dispatch_uid='tokens_access_token_deleted')
+def invalidate_access_token(sender, instance, created=False, **kwargs):
+    '''
+    Tokens are revoked by deleting them, refreshed ones are saved again.
+    This process forgets the token at once, the others on their next sync.
+    Expired tokens, e.g. deleted by cleartokens, are in no cache anymore.
+    '''
+    cache.delete_token(instance.token)
+    if not created and instance.expires > timezone.now():
+        token = instance.token
+        transaction.on_commit(lambda: RevokedToken.objects.create(token=token))
+
+
+def prune_revocations():
+    '''
+    Delete the revocations older than any cached entry
+    :return: number of revocations deleted
+    '''
+    ttl = getattr(settings, 'TOKEN_CACHE_TTL', 60)
+    deleted, per_model = RevokedToken.objects.filter(
+        revoked_at__lt=timezone.now() - timedelta(seconds=ttl + REVOCATION_OVERLAP)
+    ).delete()
+    return deleted
@@ -1,10 +1,23 @@
+from datetime import timedelta
+
 from django.shortcuts import render, redirect
+from django.http import JsonResponse
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.db.models import Q
 from django.contrib.auth.decorators import login_required
 from foodtaskerapp.forms import UserForm, RestaurantForm, UserFormForEdit, MealForm, MealCategoryForm, ModifierForm
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.models import User
-from foodtaskerapp.models import Meal, Order, Driver, MealCategory, Modifier
-from django.db.models import Sum, Count, Case, When
+from foodtaskerapp.models import Meal, Order, MealCategory, Modifier
+from foodtaskerapp import files, images, lifecycle, reports
+from foodtaskerapp.pagination import CursorPagination, InvalidCursor
+
+# Seconds of changes sent again on every dashboard refresh, and the most
+# orders sent at once
+CHANGES_OVERLAP = 5
+CHANGES_LIMIT = 200
 
 
 # Create your views here.
@@ -26,7 +39,13 @@ def restaurant_account(request):
 
     if user_form.is_valid() and restaurant_form.is_valid():
         user_form.save()
-        restaurant_form.save()
+        restaurant = restaurant_form.save(commit = False)
+        if "logo" in restaurant_form.changed_data:
+            # the renditions of the old logo no longer apply
+            restaurant.logo_hash = ""
+        restaurant.save()
+        if "logo" in restaurant_form.changed_data:
+            images.enqueue_renditions("restaurant", restaurant)
 
 
     if request.user.restaurant.logo:
@@ -53,6 +72,7 @@ def restaurant_add_meal(request):
             meal = form.save(commit=False)
             meal.restaurant = request.user.restaurant
             meal.save()
+            images.enqueue_renditions("meal", meal)
             return redirect(restaurant_meal)
 
     return render(request, 'restaurant/add_meal.html', {
@@ -69,7 +89,14 @@ def restaurant_edit_meal(request, meal_id):
         form = MealForm(request.user.restaurant, request.POST, request.FILES, instance=Meal.objects.get(id = meal_id))
 
         if form.is_valid():
-            form.save()
+            meal = form.save(commit = False)
+            if "image" in form.changed_data:
+                # the renditions of the old image no longer apply
+                meal.image_hash = ""
+            meal.save()
+            form.save_m2m()
+            if "image" in form.changed_data:
+                images.enqueue_renditions("meal", meal)
             return redirect(restaurant_meal)
 
     return render(request, 'restaurant/edit_meal.html', {
@@ -79,60 +106,93 @@ def restaurant_edit_meal(request, meal_id):
 @login_required(login_url='/restaurant/sign-in/')
 def restaurant_order(request):
     if request.method == "POST":
-        order = Order.objects.get(id = request.POST["id"], restaurant = request.user.restaurant)
-
-        if order.status == Order.PREPARING:
-            order.status = Order.READY
-            order.save()
+        lifecycle.transition(request.POST["id"], Order.PREPARING, Order.READY,
+                             conditions = {"restaurant": request.user.restaurant})
+
+    # taken before reading, so changes made while rendering are refreshed too
+    watermark = timezone.now()
+    orders = Order.objects.with_details().filter(restaurant = request.user.restaurant)
+
+    # Active orders by default, they are few. Delivered ones are paged.
+    history = request.GET.get("view") == "history"
+    next_cursor = None
+    if history:
+        try:
+            pagination = CursorPagination(request, ordering = "-id", page_size = 50)
+        except InvalidCursor:
+            return redirect(restaurant_order)
+        orders, next_cursor = pagination.paginate(orders.filter(status = Order.DELIVERED))
+    else:
+        orders = orders.filter(status__in = lifecycle.ACTIVE_STATUSES).order_by("-id")
+
+    return render(request, 'restaurant/order.html', {
+        "orders": orders,
+        "history": history,
+        "next_cursor": next_cursor,
+        "watermark": watermark.isoformat(),
+    })
 
-    orders = Order.objects.filter(restaurant = request.user.restaurant).order_by("-id")
-    return render(request, 'restaurant/order.html', {"orders": orders})
+@login_required(login_url='/restaurant/sign-in/')
+def restaurant_order_changes(request):
+    '''
+    Orders of the restaurant changed since the "since" watermark, as table
+    rows for the active orders dashboard, in the order they changed. Costs
+    the same few queries however many orders the restaurant has.
+    At most CHANGES_LIMIT orders are sent at once: the watermark is then the
+    last one's change, and "after" its id for the next refresh to go on.
+    '''
+    since = parse_datetime(request.GET.get("since", ""))
+    if since is None:
+        return JsonResponse({"status": "failed", "error": "since is required"}, status = 400)
+
+    watermark = timezone.now()
+    orders = Order.objects.with_details().filter(restaurant = request.user.restaurant)\
+        .exclude(status__in = [Order.PENDING_PAYMENT, Order.PAYMENT_FAILED])
+    if request.GET.get("after", "").isdigit():
+        # the rest of a truncated refresh
+        orders = orders.filter(Q(updated_at__gt = since) | Q(updated_at = since, id__gt = request.GET["after"]))
+    else:
+        # transactions stamped before the last watermark may have committed after it
+        orders = orders.filter(updated_at__gt = since - timedelta(seconds = CHANGES_OVERLAP))
+
+    changed = list(orders.order_by("updated_at", "id")[:CHANGES_LIMIT + 1])
+    after = None
+    if len(changed) > CHANGES_LIMIT:
+        changed = changed[:CHANGES_LIMIT]
+        watermark, after = changed[-1].updated_at, changed[-1].id
+
+    return JsonResponse({
+        "watermark": watermark.isoformat(),
+        "after": after,
+        "orders": [{
+            "id": order.id,
+            "active": order.status in lifecycle.ACTIVE_STATUSES,
+            "html": render_to_string('restaurant/order_row.html', {"order": order}, request = request),
+        } for order in changed],
+    })
 
 @login_required(login_url='/restaurant/sign-in/')
 def restaurant_report(request):
+    # Everything comes from the DailySales rollup, see foodtaskerapp.reports
     # Calculate Revenue and Number of Orders By Week
-    from datetime import datetime, timedelta
-
-    revenue = []
-    orders = []
-
-    # Calculate Weekdays
-    today = datetime.now()
-    current_weekdays = [today + timedelta(days = i) for i in range(0 - today.weekday(), 7 - today.weekday())]
-
-    for day in current_weekdays:
-        delivered_orders = Order.objects.filter(
-            restaurant = request.user.restaurant,
-            status = Order.DELIVERED,
-            created_at__year = day.year,
-            created_at__month = day.month,
-            created_at__day = day.day
-        )
-        revenue.append(sum(order.total for order in delivered_orders))
-        orders.append(delivered_orders.count())
+    current_weekdays = reports.current_week()
+    totals = reports.daily_sales(request.user.restaurant, current_weekdays)
+    revenue = [float(totals[day][0]) for day in current_weekdays]
+    orders = [totals[day][1] for day in current_weekdays]
 
 
     # Top 3 Meals
-    top3_meals = Meal.objects.filter(restaurant = request.user.restaurant)\
-                    .annotate(total_order = Sum('orderdetails__quantity'))\
-                    .order_by("-total_order")[:3]
+    top3_meals = reports.top_meals(request.user.restaurant)
     meal = {
-        "labels": [meal.name for meal in top3_meals],
-        "data": [meal.total_order or 0 for meal in top3_meals]
+        "labels": [name for name, quantity in top3_meals],
+        "data": [quantity for name, quantity in top3_meals]
     }
 
     # Top 3 Drivers
-    top3_drivers = Driver.objects.annotate(
-        total_order = Count(
-            Case (
-                When(order__restaurant = request.user.restaurant, then = 1)
-            )
-        )
-    ).order_by("-total_order")[:3]
-
+    top3_drivers = reports.top_drivers(request.user.restaurant)
     driver = {
-        "labels": [driver.user.get_full_name() for driver in top3_drivers],
-        "data": [driver.total_order for driver in top3_drivers]
+        "labels": [name for name, total_orders in top3_drivers],
+        "data": [total_orders for name, total_orders in top3_drivers]
     }
 
 
@@ -156,6 +216,7 @@ def restaurant_sign_up(request):
             new_restaurant = restaurant_form.save(commit=False)
             new_restaurant.user = new_user
             new_restaurant.save()
+            images.enqueue_renditions("restaurant", new_restaurant)
 
             login(request, authenticate(
             username = user_form.cleaned_data["username"],
@@ -298,3 +359,8 @@ def restaurant_add_modifier(request):
 # return response
 # orders = Order.objects.filter(restaurant = request.user.restaurant).order_by("-id")
 # return render(request, 'restaurant/download.html', {"orders": orders})
+
+
+def media(request, path):
+    # uploads and image renditions when DEBUG is off, see foodtaskerapp.files
+    return files.media_response(request, path)
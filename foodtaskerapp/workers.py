@@ -0,0 +1,41 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(name):
+    '''
+    Return the named background thread pool, sized by BACKGROUND_WORKERS
+    '''
+    with _pools_lock:
+        if name not in _pools:
+            max_workers = getattr(settings, 'BACKGROUND_WORKERS', {}).get(name, 2)
+            _pools[name] = ThreadPoolExecutor(max_workers=max_workers)
+        return _pools[name]
+
+
+def submit(name, function, *args, **kwargs):
+    '''
+    Run function(*args, **kwargs) on the named pool, outside of the request
+    :return: concurrent.futures.Future of the result
+    '''
+    return get_pool(name).submit(_run, function, *args, **kwargs)
+
+
+def _run(function, *args, **kwargs):
+    try:
+        return function(*args, **kwargs)
+    except Exception:
+        logger.exception('Background job %s failed', getattr(function, '__name__', function))
+        raise
+    finally:
+        # every worker thread has its own connection, do not leak it
+        connection.close()